@@ -1,4 +1,9 @@
+import os, hashlib
+import heapq
+import multiprocessing as mp
 import numpy as np
+from obspy import UTCDateTime
+import picker_pal
 
 class PS_Pair_Assoc(object):
   """ Associate P- & S-pick Pairs by searching ot and loc clustering
@@ -11,11 +16,19 @@ class PS_Pair_Assoc(object):
     max_res: threshold for P travel time res
     max_drop: each pick can only be dropped for max_drop times before being associated 
     min_sta: min number of station to alert a detection
+    xy_coarse: coarse grid factor for coarse-to-fine loc search (1 for full grid search)
+    tt_mode: 'grid' for dense time table of each sta; 'dist' for one distance-depth table shared by all sta
+    tt_dd_grid: grid width of the distance-depth time table (in km)
+    tt_dir: dir to store time tables (memory-mapped & shared by processes), None to keep in RAM
     *note: lateral distance (x-y) in degree; depth in km; elevation in m
+    *note: pick times are epoch sec (float64); picks['sta_idx'] index stations in sta_dict
   Usage
     import associator_pal
     associator = associator_pal.PS_Pair_Assoc(sta_dict)
     associator.associate(picks, out_ctlg, out_pha)
+    # or streaming: picks after t_safe may still come
+    associator.add_picks(picks, t_safe, out_ctlg, out_pha)
+    associator.flush(out_ctlg, out_pha)
   """
   def __init__(self,
                sta_dict,
@@ -26,8 +39,13 @@ class PS_Pair_Assoc(object):
                ot_dev    = 2.5,
                max_res   = 1.5,
                max_drop  = 1, 
-               min_sta   = 4):
+               min_sta   = 4,
+               xy_coarse = 1,
+               tt_mode   = 'grid',
+               tt_dd_grid= 0.5,
+               tt_dir    = None):
     self.sta_dict = sta_dict
+    self.sta_list = list(sta_dict.keys())
     self.xy_margin = xy_margin
     self.xy_grid = xy_grid
     self.z_grids = z_grids
@@ -36,26 +54,96 @@ class PS_Pair_Assoc(object):
     self.max_res = max_res
     self.max_drop = max_drop
     self.min_sta = min_sta
-    self.tt_dict = self.calc_tt()
+    self.xy_coarse = xy_coarse
+    if tt_mode not in ['grid','dist']: raise ValueError("tt_mode should be 'grid' or 'dist', got %r"%tt_mode)
+    self.tt_mode = tt_mode
+    self.tt_dd_grid = tt_dd_grid
+    self.tt_dir = tt_dir
+    self.calc_tables()
+    self.reset_stream()
+
+  # x-y grid & time tables
+  def calc_tables(self):
+    self.calc_grid()
+    if self.tt_mode=='grid': self.tt_table = self.calc_tt()
+    else: self.tt_dd = self.calc_tt_dd()
+    if self.xy_coarse>1: self.calc_coarse_grid()
 
   def associate(self, picks, out_ctlg=None, out_pha=None):
-    events_loc, events_pick = [], []
     num_picks = len(picks)
     if num_picks==0: return 
     picks = np.sort(picks, order='sta_ot')
-    # calc num of ot neighbors 
-    num_nbr = np.zeros(num_picks) 
     num_drop = np.zeros(num_picks) 
-    for ii in range(num_picks): 
-        num_nbr[ii] = sum(abs(picks['sta_ot']-picks['sta_ot'][ii]) < self.ot_dev)
-    # assoc each cluster
     print('-'*40+'\n'+'detected events:')
+    events_loc, events_pick, _, _ = self.assoc_picks(picks, num_drop, np.inf, out_ctlg, out_pha)
+    if not out_ctlg or not out_pha: return events_loc, events_pick 
+    else: return
+
+  # streaming assoc: add picks to the rolling buffer & assoc clusters that later picks cannot change
+  def add_picks(self, picks, t_safe=None, out_ctlg=None, out_pha=None):
+    """ t_safe: sta_ot of all later picks >= t_safe (default the last sta_ot of picks)
+    """
+    if t_safe is None: 
+        if len(picks)==0: return [], []
+        t_safe = np.amax(picks['sta_ot'])
+    picks = np.concatenate([self.buf_picks, picks])
+    num_drop = np.concatenate([self.buf_num_drop, np.zeros(len(picks)-len(self.buf_picks))])
+    order = np.argsort(picks, order='sta_ot')
+    picks, num_drop = picks[order], num_drop[order]
+    # clusters with ot >= t_final may still be changed by later picks
+    t_final = t_safe - 3*self.ot_dev
+    print('-'*40+'\n'+'detected events (stream, to {}):'.format(UTCDateTime(t_safe) if t_safe<np.inf else 'end'))
+    events_loc, events_pick, is_alive, is_held = self.assoc_picks(picks, num_drop, t_final, out_ctlg, out_pha)
+    # evict picks that later clusters (held or after t_final) cannot reach
+    ots = picks['sta_ot']
+    t_evict = min(t_final, np.amin(ots[is_held]) if np.any(is_held) else np.inf) - self.ot_dev
+    to_keep = is_alive * (ots >= t_evict)
+    self.buf_picks, self.buf_num_drop = picks[to_keep], num_drop[to_keep]
+    if not out_ctlg or not out_pha: return events_loc, events_pick
+
+  # assoc all picks left in the stream buffer
+  def flush(self, out_ctlg=None, out_pha=None):
+    out = self.add_picks(self.buf_picks[0:0], np.inf, out_ctlg, out_pha)
+    self.reset_stream()
+    return out
+
+  # release workers (none here, see Tiled_Assoc)
+  def close(self):
+    pass
+
+  def reset_stream(self):
+    dtype = picker_pal.STA_LTA_Kurtosis.pick_dtype
+    self.buf_picks = np.array([], dtype=dtype)
+    self.buf_num_drop = np.zeros(0)
+
+  # greedy ot clustering & loc assoc on time-sorted picks, for clusters with ot < t_final
+  # clusters with ot >= t_final are deferred: picks within 2*ot_dev of them are held for later
+  def assoc_picks(self, picks, num_drop, t_final, out_ctlg=None, out_pha=None):
+    events_loc, events_pick = [], []
+    num_picks = len(picks)
+    ots = np.ascontiguousarray(picks['sta_ot'])
+    # calc num of ot neighbors (on time-sorted ots)
+    idx0, idx1 = self.find_nbr_range(ots, ots, self.ot_dev)
+    num_nbr = idx1 - idx0
+    is_alive = np.ones(num_picks, dtype=bool)
+    is_held = np.zeros(num_picks, dtype=bool)
+    # max-heap of (num_nbr, idx); outdated & held entries are skipped on pop
+    nbr_heap = list(zip(-num_nbr, range(num_picks)))
+    heapq.heapify(nbr_heap)
+    # assoc each cluster
     for _ in range(num_picks):
-        if np.amax(num_nbr) < self.min_sta: break 
+        while len(nbr_heap)>0:
+            num_nbr_i, idx_i = -nbr_heap[0][0], nbr_heap[0][1]
+            if not is_alive[idx_i] or is_held[idx_i] or num_nbr_i!=num_nbr[idx_i]: heapq.heappop(nbr_heap)
+            elif num_nbr_i >= self.min_sta and ots[idx_i] >= t_final:
+                idx0, idx1 = self.find_nbr_range(ots, ots[idx_i], 2*self.ot_dev)
+                is_held[idx0:idx1] = True
+            else: break
+        if len(nbr_heap)==0 or -nbr_heap[0][0] < self.min_sta: break 
         # 1. ot assoc
-        ots = picks['sta_ot']
-        ot_i = ots[np.argmax(num_nbr)]
-        to_assoc_idx = np.where(abs(ots-ot_i) < self.ot_dev)[0]
+        ot_i = ots[nbr_heap[0][1]]
+        idx0, idx1 = self.find_nbr_range(ots, ot_i, self.ot_dev)
+        to_assoc_idx = np.arange(idx0, idx1)[is_alive[idx0:idx1] * ~is_held[idx0:idx1]]
         # 2. loc assoc
         event_loc, event_pick, assoc_idx, drop_idx = self.assoc_loc(picks[to_assoc_idx])
         if len(event_loc)>0: 
@@ -68,62 +156,62 @@ class PS_Pair_Assoc(object):
             dep = event_loc_mag['evt_dep']
             mag = event_loc_mag['mag']
             res = event_loc_mag['res']
-            print('{} {} {} {:>2} {} | res {}s'.format(ot, lat, lon, dep, mag, res))
+            print('{} {} {} {:>2} {} | res {}s'.format(UTCDateTime(ot), lat, lon, dep, mag, res))
             # write catalog and phase
             if out_ctlg: self.write_catalog(event_loc_mag, out_ctlg)
             if out_pha: self.write_phase(event_loc_mag, event_pick, out_pha)
             events_loc.append(event_loc_mag)
             events_pick.append(event_pick)
         # del picks that are associated or dropped to many times
-        drop_idx = np.array(drop_idx, dtype=np.int32) + to_assoc_idx[0]
-        assoc_idx = np.array(assoc_idx, dtype=np.int32) + to_assoc_idx[0]
+        drop_idx = to_assoc_idx[np.array(drop_idx, dtype=np.int32)]
+        assoc_idx = to_assoc_idx[np.array(assoc_idx, dtype=np.int32)]
         num_drop[drop_idx] += 1
-        to_del = np.unique(np.concatenate([assoc_idx, np.where(num_drop > self.max_drop)[0]]))
+        to_del = np.unique(np.concatenate([assoc_idx, drop_idx[num_drop[drop_idx] > self.max_drop]]))
         # renew num_nbr 
-        to_renew_idx = np.where(abs(ots-ot_i) < 2*self.ot_dev)[0]
-        for idx in to_renew_idx:
-            num_nbr[idx] -= sum(abs(ots[to_del]-ots[idx]) < self.ot_dev)
+        idx0, idx1 = self.find_nbr_range(ots, ot_i, 2*self.ot_dev)
+        to_renew_idx = np.arange(idx0, idx1)[is_alive[idx0:idx1]]
+        num_del = np.sum(abs(ots[to_del][None,:] - ots[to_renew_idx][:,None]) < self.ot_dev, axis=1)
+        num_nbr[to_renew_idx] -= num_del
         # update picks, num_nbr, and num_drop
-        picks = np.delete(picks, to_del)
-        num_nbr = np.delete(num_nbr, to_del)
-        num_drop = np.delete(num_drop, to_del)
-    if not out_ctlg or not out_pha: return events_loc, events_pick 
-    else: return
+        is_alive[to_del] = False
+        for idx in to_renew_idx[(num_del>0) & is_alive[to_renew_idx]]:
+            heapq.heappush(nbr_heap, (-num_nbr[idx], idx))
+    return events_loc, events_pick, is_alive, is_held
+
+  # index range [idx0, idx1) of sorted ots that satisfy abs(ots-ot_c) < ot_dev
+  def find_nbr_range(self, ots, ot_c, ot_dev):
+    num_picks = len(ots)
+    ot_c = np.asarray(ot_c)
+    idx0 = np.searchsorted(ots, ot_c-ot_dev, side='left')
+    idx1 = np.searchsorted(ots, ot_c+ot_dev, side='right')
+    # fix round-off at win edges, to match abs(ots-ot_c) < ot_dev exactly
+    while True:
+        ot0_out, ot0_in = ots[np.minimum(idx0, num_picks-1)], ots[np.maximum(idx0-1, 0)]
+        ot1_out, ot1_in = ots[np.minimum(idx1, num_picks-1)], ots[np.maximum(idx1-1, 0)]
+        to_dec0 = (idx0>0) * (abs(ot0_in-ot_c) < ot_dev)
+        to_inc0 = (idx0<num_picks) * (ot0_out<ot_c) * (abs(ot0_out-ot_c) >= ot_dev)
+        to_inc1 = (idx1<num_picks) * (abs(ot1_out-ot_c) < ot_dev)
+        to_dec1 = (idx1>0) * (ot1_in>ot_c) * (abs(ot1_in-ot_c) >= ot_dev)
+        if not np.any(to_dec0 + to_inc0 + to_inc1 + to_dec1): break
+        idx0 = idx0 - to_dec0 + to_inc0
+        idx1 = idx1 + to_inc1 - to_dec1
+    return idx0, idx1
 
   def assoc_loc(self, picks):
-    res_ttp_mat = 0 # P travel time res
-    num_sta_mat = 0 # number of associated stations
-    det_dict = {} # potential det loc for each sta
     ot = picks['sta_ot'][len(picks)//2]
-    for ii, pick in enumerate(picks):
-        net_sta = pick['net_sta']
-        pick_key = '%s_%s'%(ii, net_sta)
-        ttp_obs = pick['tp'] - ot # pick time to travel time
-        ttp_pred = self.tt_dict[net_sta]
-        res_i = abs(ttp_pred - ttp_obs)
-        is_det = (res_i < self.max_res).astype(float)
-        res_i[res_i >= self.max_res] = 0.
-        # update res_mat, num_sta_mat, and det_dict
-        res_ttp_mat += res_i
-        num_sta_mat += is_det
-        det_dict[pick_key] = is_det
+    ttp_obs = (picks['tp'] - ot).astype(np.float32) # pick time to travel time
     # find loc of min res (grid search location)
-    num_sta = np.amax(num_sta_mat)
+    if self.xy_coarse>1: search_out = self.search_grid_coarse(picks['sta_idx'], ttp_obs)
+    else: search_out = self.search_grid(picks['sta_idx'], ttp_obs)
+    num_sta, res, [zi, xi, yi], is_assoc = search_out
     if num_sta < self.min_sta: return [],[],[],list(range(len(picks)))
-    res_ttp_mat /= num_sta
-    res_ttp_mat [num_sta_mat < num_sta] = np.inf
-    res = np.amin(res_ttp_mat)
-    zi, xi, yi = np.unravel_index(np.argmin(res_ttp_mat), res_ttp_mat.shape)
     lon = self.lon_min + xi * self.xy_grid
     lat = self.lat_min + yi * self.xy_grid
     dep = self.z_grids[zi]
     # find associated phase & index
-    event_pick, assoc_idx, drop_idx = [], [], []
-    for ii,pick in enumerate(picks):
-        if det_dict['%s_%s'%(ii,pick['net_sta'])][zi,xi,yi]==1.:
-            event_pick.append(pick)
-            assoc_idx.append(ii)
-        else: drop_idx.append(ii)
+    event_pick = list(picks[is_assoc])
+    assoc_idx = list(np.where(is_assoc)[0])
+    drop_idx = list(np.where(~is_assoc)[0])
     # output as dict
     event_loc = {'evt_ot' : ot, 
                  'evt_lon': round(lon,2), 
@@ -132,41 +220,180 @@ class PS_Pair_Assoc(object):
                  'res': round(res,1)}
     return event_loc, event_pick, assoc_idx, drop_idx
 
-  # calc P travel time table
-  def calc_tt(self):
-    print('making time table')
-    tt_dict = {}
-    # get x-y range: sta range + margin
-    sta_loc = self.sta_dict.values()
+  # grid search on the full grid
+  def search_grid(self, sta_idx, ttp_obs):
+    # stack P travel time res of all picks: num_picks * z * x * y
+    res_ttp = self.get_tt(sta_idx)
+    res_ttp -= ttp_obs.reshape(-1,1,1,1)
+    np.abs(res_ttp, out=res_ttp)
+    is_det = (res_ttp < self.max_res).view(np.uint8)
+    res_ttp *= is_det
+    # P travel time res & number of associated stations
+    res_ttp_mat = np.sum(res_ttp, axis=0)
+    num_sta_mat = np.sum(is_det, axis=0, dtype=np.int32)
+    num_sta = np.amax(num_sta_mat)
+    if num_sta < self.min_sta: return num_sta, None, [None]*3, None
+    res_ttp_mat /= num_sta
+    res_ttp_mat [num_sta_mat < num_sta] = np.inf
+    res = float(np.amin(res_ttp_mat))
+    zi, xi, yi = np.unravel_index(np.argmin(res_ttp_mat), res_ttp_mat.shape)
+    return num_sta, res, [zi, xi, yi], is_det[:,zi,xi,yi]==1
+
+  # coarse-to-fine grid search, same result as search_grid
+  def search_grid_coarse(self, sta_idx, ttp_obs):
+    num_z, x_num, y_num = len(self.z_grids), self.x_num, self.y_num
+    # upper bound of num_sta in each coarse block: relax max_res by the block size
+    tt_coarse = self.tt_coarse[sta_idx] if self.tt_mode=='grid' else self.get_tt(sta_idx, self.node_idx)
+    res_ttp = abs(tt_coarse - ttp_obs.reshape(-1,1,1))
+    num_sta_max = np.amax(np.sum(res_ttp < self.max_res + self.coarse_tol, axis=0, dtype=np.int32), axis=0)
+    # refine blocks that may hold the best fine cell
+    is_eval = np.zeros(num_sta_max.shape, dtype=bool)
+    num_sta, thres = 0, max(np.amax(num_sta_max), self.min_sta)
+    cell_idx, num_sta_list, res_list = [], [], []
+    while True:
+        to_eval = (num_sta_max >= thres) * ~is_eval
+        if not np.any(to_eval): break
+        is_eval += to_eval
+        xy_idx = np.where(to_eval[self.block_idx])[0]
+        res_ttp = self.get_tt(sta_idx, xy_idx)
+        res_ttp -= ttp_obs.reshape(-1,1,1)
+        np.abs(res_ttp, out=res_ttp)
+        is_det = (res_ttp < self.max_res).view(np.uint8)
+        res_ttp *= is_det
+        res_list.append(np.sum(res_ttp, axis=0).ravel())
+        num_sta_list.append(np.sum(is_det, axis=0, dtype=np.int32).ravel())
+        cell_idx.append((np.arange(num_z).reshape(-1,1)*x_num*y_num + xy_idx).ravel())
+        num_sta = max(num_sta, np.amax(num_sta_list[-1]))
+        thres = max(num_sta, self.min_sta)
+    if num_sta < self.min_sta: return num_sta, None, [None]*3, None
+    # min res in evaluated cells; ties go to the first cell as in np.argmin
+    cell_idx = np.concatenate(cell_idx)
+    res_ttp_mat = np.concatenate(res_list)
+    res_ttp_mat /= num_sta
+    res_ttp_mat [np.concatenate(num_sta_list) < num_sta] = np.inf
+    order = np.argsort(cell_idx)
+    best_idx = cell_idx[order[np.argmin(res_ttp_mat[order])]]
+    res = float(np.amin(res_ttp_mat))
+    zi, xi, yi = np.unravel_index(best_idx, [num_z, x_num, y_num])
+    res_best = abs(self.get_tt(sta_idx, np.array([xi*y_num + yi]))[:,zi,0] - ttp_obs)
+    return num_sta, res, [zi, xi, yi], res_best < self.max_res
+
+  # coarse grid: one node per xy_coarse*xy_coarse block of fine cells
+  def calc_coarse_grid(self):
+    x_num, y_num = self.x_num, self.y_num
+    x_node = np.array([xi + (min(self.xy_coarse, x_num-xi)-1)//2 for xi in range(0, x_num, self.xy_coarse)])
+    y_node = np.array([yi + (min(self.xy_coarse, y_num-yi)-1)//2 for yi in range(0, y_num, self.xy_coarse)])
+    self.node_idx = (x_node.reshape(-1,1)*y_num + y_node.reshape(1,-1)).ravel()
+    if self.tt_mode=='grid': self.tt_coarse = self.get_tt(np.arange(len(self.sta_dict)), self.node_idx)
+    # coarse block index of each fine cell (flat x-y)
+    x_block, y_block = np.arange(x_num)//self.xy_coarse, np.arange(y_num)//self.xy_coarse
+    self.block_idx = (x_block.reshape(-1,1)*len(y_node) + y_block.reshape(1,-1)).ravel()
+    # max tt change within a block: lateral offset to node <= xy_coarse//2 grids
+    self.coarse_tol = 111 * np.sqrt(2) * (self.xy_coarse//2) * self.xy_grid / self.vp + 1e-3
+
+  # P travel time of picked sta to grid cells: num_picks * z * x * y, or num_picks * z * len(xy_idx)
+  def get_tt(self, sta_idx, xy_idx=None):
+    num_z = len(self.z_grids)
+    if self.tt_mode=='grid':
+        if xy_idx is None: return self.tt_table[sta_idx]
+        tt_flat = self.tt_table.reshape(len(self.sta_dict), num_z, -1)
+        return tt_flat[sta_idx.reshape(-1,1,1), np.arange(num_z).reshape(1,-1,1), xy_idx.reshape(1,1,-1)]
+    # interp the distance-depth table for the cells
+    xy_all = xy_idx is None
+    if xy_all: xy_idx = np.arange(self.x_num*self.y_num)
+    sta_lat, sta_lon, sta_ele = self.sta_loc[sta_idx].T.reshape(3,-1,1)
+    lon = self.lon_min + (xy_idx // self.y_num) * self.xy_grid
+    lat = self.lat_min + (xy_idx % self.y_num) * self.xy_grid
+    dx = 111 * (lon - sta_lon) * np.cos(sta_lat * np.pi/180)
+    dy = 111 * (lat - sta_lat)
+    dist = np.sqrt(dx**2 + dy**2).astype(np.float32)
+    dep = (np.array(self.z_grids) + sta_ele/1000.).astype(np.float32)
+    tt = self.interp_tt_dd(dist.reshape(len(sta_idx),1,-1), dep.reshape(len(sta_idx),-1,1))
+    if xy_all: return tt.reshape(len(sta_idx), num_z, self.x_num, self.y_num)
+    return tt
+
+  # bilinear interp of distance-depth time table
+  def interp_tt_dd(self, dist, dep):
+    num_dep, num_dist = self.tt_dd.shape
+    dist_idx = dist / self.tt_dd_grid
+    dep_idx = (dep - self.dd_dep_min) / self.tt_dd_grid
+    dist_i0 = np.clip(dist_idx.astype(np.int32), 0, num_dist-2)
+    dep_i0 = np.clip(dep_idx.astype(np.int32), 0, num_dep-2)
+    w_dist, w_dep = dist_idx - dist_i0, dep_idx - dep_i0
+    tt0 = self.tt_dd[dep_i0, dist_i0] * (1-w_dist) + self.tt_dd[dep_i0, dist_i0+1] * w_dist
+    tt1 = self.tt_dd[dep_i0+1, dist_i0] * (1-w_dist) + self.tt_dd[dep_i0+1, dist_i0+1] * w_dist
+    return tt0 * (1-w_dep) + tt1 * w_dep
+
+  # calc P travel time vs. epicentral distance & depth (incl. sta elevation)
+  def calc_tt_dd(self):
+    print('making distance-depth time table')
+    self.sta_loc = np.array([sta_loc[0:3] for sta_loc in self.sta_dict.values()], dtype=np.float64)
+    # max distance: diagonal of x-y grid
+    max_dist = 111 * np.sqrt(self.x_num**2 + self.y_num**2) * self.xy_grid
+    dep = np.array(self.z_grids).reshape(-1,1) + self.sta_loc[:,2]/1000.
+    self.dd_dep_min = np.amin(dep)
+    dist_grids = np.arange(0, max_dist + 2*self.tt_dd_grid, self.tt_dd_grid)
+    dep_grids = np.arange(self.dd_dep_min, np.amax(dep) + 2*self.tt_dd_grid, self.tt_dd_grid)
+    tt_dd = np.sqrt(dist_grids.reshape(1,-1)**2 + dep_grids.reshape(-1,1)**2) / self.vp
+    return tt_dd.astype(np.float32)
+
+  # set x-y grid: sta range + margin
+  def calc_grid(self):
     lat = [sta_loc[0] for sta_loc in self.sta_dict.values()]
     lon = [sta_loc[1] for sta_loc in self.sta_dict.values()]
     lon_margin = self.xy_margin * (np.amax(lon) - np.amin(lon))
     lat_margin = self.xy_margin * (np.amax(lat) - np.amin(lat))
     lon_min, lon_max = np.amin(lon)-lon_margin, np.amax(lon)+lon_margin
     lat_min, lat_max = np.amin(lat)-lat_margin, np.amax(lat)+lat_margin
-    # set x-y grid
-    x_num = int((lon_max-lon_min) / self.xy_grid)
-    y_num = int((lat_max-lat_min) / self.xy_grid)
-    # calc P travel time table
-    for net_sta, [sta_lat,sta_lon,sta_ele,_] in self.sta_dict.items():
-        cos_lat = np.cos(sta_lat * np.pi/180)
-        ttp = -np.ones([len(self.z_grids), x_num, y_num])
-        for xi in range(x_num):
-          for yi in range(y_num):
-            for zi,dep in enumerate(self.z_grids):
-                dx = 111 * (lon_min + xi*self.xy_grid - sta_lon) * cos_lat
-                dy = 111 * (lat_min + yi*self.xy_grid - sta_lat)
-                dz = dep + sta_ele/1000.
-                ttp[zi,xi,yi] = np.sqrt(dx**2 + dy**2 + dz**2) / self.vp
-        tt_dict[net_sta] = ttp
+    self.x_num = int((lon_max-lon_min) / self.xy_grid)
+    self.y_num = int((lat_max-lat_min) / self.xy_grid)
     self.lat_min, self.lon_min = lat_min, lon_min
-    return tt_dict
+
+  # calc P travel time table
+  def calc_tt(self):
+    shape = [len(self.sta_dict), len(self.z_grids), self.x_num, self.y_num]
+    if not self.tt_dir:
+        print('making time table')
+        tt_table = np.zeros(shape, dtype=np.float32)
+        self.fill_tt(tt_table, self.lon_min, self.lat_min)
+        return tt_table
+    # load from / write to memory-mapped store
+    tt_path = os.path.join(self.tt_dir, 'tt_%s.npy'%self.get_tt_key())
+    if not os.path.exists(tt_path):
+        print('making time table: %s'%tt_path)
+        if not os.path.exists(self.tt_dir): os.makedirs(self.tt_dir, exist_ok=True)
+        tmp_path = '%s.%s.tmp'%(tt_path, os.getpid())
+        tt_table = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=tuple(shape))
+        self.fill_tt(tt_table, self.lon_min, self.lat_min)
+        tt_table.flush(); del tt_table
+        os.replace(tmp_path, tt_path)
+    else: print('loading time table: %s'%tt_path)
+    return np.load(tt_path, mmap_mode='r')
+
+  # fill P travel time table for each sta: z * x * y
+  def fill_tt(self, tt_table, lon_min, lat_min):
+    x_num, y_num = tt_table.shape[2:]
+    lon_grids = lon_min + np.arange(x_num)*self.xy_grid
+    lat_grids = lat_min + np.arange(y_num)*self.xy_grid
+    for sta_idx, [sta_lat,sta_lon,sta_ele,_] in enumerate(self.sta_dict.values()):
+        cos_lat = np.cos(sta_lat * np.pi/180)
+        dx = 111 * (lon_grids - sta_lon) * cos_lat
+        dy = 111 * (lat_grids - sta_lat)
+        dz = np.array(self.z_grids) + sta_ele/1000.
+        dist2 = dx.reshape(1,-1,1)**2 + dy.reshape(1,1,-1)**2 + dz.reshape(-1,1,1)**2
+        tt_table[sta_idx] = np.sqrt(dist2) / self.vp
+
+  # key of time table: hash of sta locs, grid, & vp
+  def get_tt_key(self):
+    sta_locs = [[net_sta] + list(sta_loc[0:3]) for net_sta, sta_loc in self.sta_dict.items()]
+    tt_params = [sta_locs, self.xy_margin, self.xy_grid, list(np.array(self.z_grids, dtype=float)), self.vp]
+    return hashlib.md5(repr(tt_params).encode()).hexdigest()
 
   def calc_mag(self, event_pick, event_loc):
     num_sta = len(event_pick)
     mag = -np.ones(num_sta)
     for i,pick in enumerate(event_pick):
-        sta_lat, sta_lon, sta_ele = self.sta_dict[pick['net_sta']][0:3]
+        sta_lat, sta_lon, sta_ele = self.sta_dict[self.sta_list[pick['sta_idx']]][0:3]
         # get S amp
         if 's_amp' not in pick.dtype.names: continue
         amp = pick['s_amp'] * 1e6 # m to miu m
@@ -188,7 +415,7 @@ class PS_Pair_Assoc(object):
     lat = event_loc['evt_lat']
     dep = event_loc['evt_dep']
     mag = event_loc['mag'] if 'mag' in event_loc else -1
-    out_ctlg.write('{},{},{},{},{}\n'.format(ot, lat, lon, dep, mag))
+    out_ctlg.write('{},{},{},{},{}\n'.format(UTCDateTime(ot), lat, lon, dep, mag))
 
   def write_phase(self, event_loc, event_pick, out_pha):
     ot  = event_loc['evt_ot']
@@ -196,11 +423,211 @@ class PS_Pair_Assoc(object):
     lat = event_loc['evt_lat']
     dep = event_loc['evt_dep']
     mag = event_loc['mag']
-    out_pha.write('{},{},{},{},{}\n'.format(ot, lat, lon, dep, mag))
+    out_pha.write('{},{},{},{},{}\n'.format(UTCDateTime(ot), lat, lon, dep, mag))
     for pick in event_pick:
-        net_sta = pick['net_sta']
-        tp = pick['tp']
-        ts = pick['ts']
+        net_sta = self.sta_list[pick['sta_idx']]
+        tp = UTCDateTime(pick['tp'])
+        ts = UTCDateTime(pick['ts'])
         s_amp = pick['s_amp'] if 's_amp' in pick.dtype.names else -1
         out_pha.write('{},{},{},{}\n'.format(net_sta, tp, ts, s_amp))
 
+
+
+class Tiled_Assoc(PS_Pair_Assoc):
+  """ Associate picks of a regional network in overlapping spatial tiles
+  Inputs
+    sta_dict: station location dict
+    tile_size: lateral size of each tile (in degree)
+    tile_margin: sta within tile_margin (in degree) around a tile are also used by the tile
+    num_workers: num of processes to assoc tiles in parallel
+    assoc_kwargs: PS_Pair_Assoc params of each tile (grid & time table are made per tile)
+    *note: events found by several tiles are merged, see merge_events; events of different tiles
+      with disjoint picks are de-duplicated by ot (ot_dev) & epicenter (tile_margin), see dedup_events
+    *note: the worker pool is made once at init (before any assoc thread starts, as forking from a thread is unsafe)
+      & kept until close(), which drivers must call
+  Usage
+    import associator_pal
+    associator = associator_pal.Tiled_Assoc(sta_dict, tile_size, tile_margin, num_workers, **assoc_kwargs)
+    associator.associate(picks, out_ctlg, out_pha)
+    associator.close()
+  """
+  def __init__(self, sta_dict, tile_size=1., tile_margin=0.5, num_workers=1, **assoc_kwargs):
+    self.tile_size = tile_size
+    self.tile_margin = tile_margin
+    self.num_workers = num_workers
+    self.assoc_kwargs = assoc_kwargs
+    self.pool = None
+    super(Tiled_Assoc, self).__init__(sta_dict, **assoc_kwargs)
+    # forked from the calling thread: make it here, not in associate (may run in a thread)
+    if self.num_workers>1:
+        self.pool = mp.Pool(self.num_workers, initializer=init_tile_worker, initargs=(self,))
+
+  # tile associators, each with its own grid & time tables
+  def calc_tables(self):
+    self.tiles_sta = self.split_tiles()
+    self.tile_assocs = []
+    for tile_idx, sta_idx in enumerate(self.tiles_sta):
+        print('tile %s: %s sta'%(tile_idx, len(sta_idx)))
+        tile_sta_dict = {self.sta_list[ii]: self.sta_dict[self.sta_list[ii]] for ii in sta_idx}
+        self.tile_assocs.append(PS_Pair_Assoc(tile_sta_dict, **self.assoc_kwargs))
+
+  def reset_stream(self):
+    for associator in self.tile_assocs: associator.reset_stream()
+    self.stream_picked = {}
+    self.stream_events = []
+
+  def associate(self, picks, out_ctlg=None, out_pha=None):
+    if len(picks)==0: return 
+    tile_picks = [self.get_tile_picks(picks, tile_idx) for tile_idx in range(len(self.tiles_sta))]
+    if self.pool: events = self.pool.map(run_tile_worker, list(enumerate(tile_picks)), chunksize=1)
+    else: events = [self.assoc_tile(tile_idx, picks) for tile_idx, picks in enumerate(tile_picks)]
+    return self.write_events(self.dedup_events(merge_events(sum(events, []))), out_ctlg, out_pha)
+
+  def close(self):
+    if self.pool is None: return
+    self.pool.close(); self.pool.join()
+    self.pool = None
+
+  # the worker pool is not sent to workers
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state['pool'] = None
+    return state
+
+  # drop events close to a better event (more picks, then smaller res) in ot & epicenter
+  def dedup_events(self, events, events_prev=[]):
+    events = sorted(events, key=lambda evt: (-len(evt[1]), evt[0]['res'], evt[0]['evt_ot']))
+    # kept events in bins of ot_dev
+    ot_bins = {}
+    for event_loc, _ in events_prev:
+        ot_bins.setdefault(int(event_loc['evt_ot'] // self.ot_dev), []).append(event_loc)
+    events_kept = []
+    for event_loc, event_pick in events:
+        ot_bin = int(event_loc['evt_ot'] // self.ot_dev)
+        nbr_locs = sum([ot_bins.get(ot_bin+ii, []) for ii in [-1,0,1]], [])
+        if any([self.is_same_event(event_loc, nbr_loc) for nbr_loc in nbr_locs]): continue
+        ot_bins.setdefault(ot_bin, []).append(event_loc)
+        events_kept.append((event_loc, event_pick))
+    return sorted(events_kept, key=lambda evt: evt[0]['evt_ot'])
+
+  def is_same_event(self, loc0, loc1):
+    if abs(loc0['evt_ot'] - loc1['evt_ot']) >= self.ot_dev: return False
+    dist_lon = (loc0['evt_lon'] - loc1['evt_lon']) * np.cos(loc0['evt_lat'] * np.pi/180)
+    dist_lat = loc0['evt_lat'] - loc1['evt_lat']
+    return np.sqrt(dist_lon**2 + dist_lat**2) < self.tile_margin
+
+  # streaming assoc of each tile, see PS_Pair_Assoc.add_picks
+  def add_picks(self, picks, t_safe=None, out_ctlg=None, out_pha=None):
+    if t_safe is None: 
+        if len(picks)==0: return [], []
+        t_safe = np.amax(picks['sta_ot'])
+    events = []
+    for tile_idx, associator in enumerate(self.tile_assocs):
+        events_loc, events_pick = associator.add_picks(self.get_tile_picks(picks, tile_idx), t_safe)
+        events += self.get_tile_events(tile_idx, events_loc, events_pick)
+    # tiles may finish the same event in different calls: drop events with picks already written
+    events_new = []
+    for event in events:
+        pick_keys = [(pick['sta_idx'], pick['tp']) for pick in event[2]]
+        if not any([key in self.stream_picked for key in pick_keys]): events_new.append(event)
+    events_new = self.dedup_events(merge_events(events_new), self.stream_events)
+    for _, event_pick in events_new:
+        self.stream_picked.update({(pick['sta_idx'], pick['tp']): pick['tp'] for pick in event_pick})
+    self.stream_events += events_new
+    # picks out of all tile buffers cannot be claimed again, nor make events before their sta_ot
+    tp_min = min([np.amin(associator.buf_picks['tp']) if len(associator.buf_picks)>0 else np.inf \
+        for associator in self.tile_assocs])
+    ot_min = min([np.amin(associator.buf_picks['sta_ot']) if len(associator.buf_picks)>0 else np.inf \
+        for associator in self.tile_assocs])
+    self.stream_picked = {key: tp for key, tp in self.stream_picked.items() if tp >= tp_min}
+    self.stream_events = [event for event in self.stream_events if event[0]['evt_ot'] >= ot_min - 2*self.ot_dev]
+    return self.write_events(events_new, out_ctlg, out_pha)
+
+  def flush(self, out_ctlg=None, out_pha=None):
+    out = self.add_picks(self.tile_assocs[0].buf_picks[0:0], np.inf, out_ctlg, out_pha)
+    self.reset_stream()
+    return out
+
+  # assoc picks of one tile, with tile sta_idx
+  def assoc_tile(self, tile_idx, picks):
+    if len(picks)==0: return []
+    events_loc, events_pick = self.tile_assocs[tile_idx].associate(picks)
+    return self.get_tile_events(tile_idx, events_loc, events_pick)
+
+  # picks of tile sta, sta_idx changed to tile sta_idx
+  def get_tile_picks(self, picks, tile_idx):
+    sta_idx = self.tiles_sta[tile_idx]
+    tile_sta_idx = -np.ones(len(self.sta_list), dtype=np.int32)
+    tile_sta_idx[sta_idx] = np.arange(len(sta_idx))
+    picks = picks[tile_sta_idx[picks['sta_idx']] >= 0]
+    picks['sta_idx'] = tile_sta_idx[picks['sta_idx']]
+    return picks
+
+  # (tile_idx, event_loc, event_pick), with event_pick of global sta_idx
+  def get_tile_events(self, tile_idx, events_loc, events_pick):
+    events = []
+    for event_loc, event_pick in zip(events_loc, events_pick):
+        event_pick = np.array(event_pick)
+        event_pick['sta_idx'] = self.tiles_sta[tile_idx][event_pick['sta_idx']]
+        events.append((tile_idx, event_loc, list(event_pick)))
+    return events
+
+  def write_events(self, events, out_ctlg, out_pha):
+    events_loc, events_pick = [], []
+    for event_loc, event_pick in events:
+        if out_ctlg: self.write_catalog(event_loc, out_ctlg)
+        if out_pha: self.write_phase(event_loc, event_pick, out_pha)
+        events_loc.append(event_loc)
+        events_pick.append(event_pick)
+    if not out_ctlg or not out_pha: return events_loc, events_pick
+
+  # split sta into tiles (+ margin); tiles with too few sta are skipped
+  def split_tiles(self):
+    lat = np.array([sta_loc[0] for sta_loc in self.sta_dict.values()])
+    lon = np.array([sta_loc[1] for sta_loc in self.sta_dict.values()])
+    x_num = max(1, int(np.ceil((np.amax(lon) - np.amin(lon)) / self.tile_size)))
+    y_num = max(1, int(np.ceil((np.amax(lat) - np.amin(lat)) / self.tile_size)))
+    tiles_sta = []
+    for xi in range(x_num):
+        for yi in range(y_num):
+            lon0 = np.amin(lon) + xi*self.tile_size - self.tile_margin
+            lat0 = np.amin(lat) + yi*self.tile_size - self.tile_margin
+            lon1 = lon0 + self.tile_size + 2*self.tile_margin
+            lat1 = lat0 + self.tile_size + 2*self.tile_margin
+            sta_idx = np.where((lon>=lon0) * (lon<=lon1) * (lat>=lat0) * (lat<=lat1))[0]
+            if len(sta_idx) >= self.min_sta: tiles_sta.append(sta_idx)
+    return tiles_sta
+
+
+# merge events found by overlapping parts (tiles or time partitions): each pick goes to one event
+def merge_events(events):
+    """ events: list of (part_idx, event_loc, event_pick), event_pick['sta_idx'] of the same sta_dict
+        more picks first, then smaller res, smaller part_idx & earlier ot
+    """
+    events = sorted(events, key=lambda evt: (-len(evt[2]), evt[1]['res'], evt[0], evt[1]['evt_ot']))
+    picked, events_merged = set(), []
+    for part_idx, event_loc, event_pick in events:
+        pick_keys = [(pick['sta_idx'], pick['tp']) for pick in event_pick]
+        if any([key in picked for key in pick_keys]): continue
+        picked.update(pick_keys)
+        events_merged.append((event_loc, event_pick))
+    return sorted(events_merged, key=lambda evt: evt[0]['evt_ot'])
+
+# picks of events dropped by merge_events & not claimed by merged events, to re-assoc
+def get_left_picks(events, events_merged):
+    picked = set([(pick['sta_idx'], pick['tp']) for _, event_pick in events_merged for pick in event_pick])
+    picks_left = {}
+    for _, _, event_pick in events:
+        for pick in event_pick:
+            key = (pick['sta_idx'], pick['tp'])
+            if key not in picked: picks_left[key] = pick
+    if len(picks_left)==0: return None
+    return np.sort(np.array(list(picks_left.values())), order='sta_ot')
+
+# assoc tiles in subprocess
+def init_tile_worker(tiled_assoc):
+    global worker_assoc
+    worker_assoc = tiled_assoc
+
+def run_tile_worker(tile):
+    return worker_assoc.assoc_tile(*tile)
@@ -0,0 +1,199 @@
+""" Benchmark PAL kernels against their loop implementations
+    usage: python benchmark.py --target=kurtosis (pca, assoc, prep, workers, all)
+"""
+import io, time, contextlib
+import argparse
+import numpy as np
+from scipy.stats import kurtosis
+from scipy.signal import resample_poly
+from obspy import Stream, Trace
+import picker_pal
+import preprocess_lib
+from tests.conftest import OT_Assoc, make_stream
+
+# old loop implementation, kept as reference
+def calc_kurtosis_loop(data, win_kurt_npts):
+    npts = len(data) - win_kurt_npts + 1
+    kurt = np.zeros(npts)
+    for i in range(npts):
+        kurt[i] = kurtosis(data[i:i+win_kurt_npts])
+    return kurt
+
+def calc_pca_filter_loop(picker, data, idx_p, pca_range_npts, pca_win_npts):
+    p_mat = data[:, idx_p : idx_p + pca_win_npts]
+    p_r, p_v = picker.calc_pol(p_mat)
+    idx_range = range(idx_p - pca_range_npts[0],
+                      idx_p + pca_range_npts[1])
+    pca_filter = np.zeros(len(idx_range))
+    for i, idx in enumerate(idx_range):
+        s_mat = data[:, idx : idx + pca_win_npts]
+        s_r, s_v = picker.calc_pol(s_mat)
+        abs_cos = abs(np.dot(p_v, s_v))
+        pca_filter[i] = 1 - s_r * abs_cos
+    return pca_filter
+
+# old ot clustering loop in PS_Pair_Assoc.associate
+def associate_loop(associator, picks):
+    num_picks = len(picks)
+    picks = np.sort(picks, order='sta_ot')
+    num_nbr = np.zeros(num_picks) 
+    num_drop = np.zeros(num_picks) 
+    for ii in range(num_picks): 
+        num_nbr[ii] = sum(abs(picks['sta_ot']-picks['sta_ot'][ii]) < associator.ot_dev)
+    events_ot = []
+    for _ in range(num_picks):
+        if np.amax(num_nbr) < associator.min_sta: break 
+        ots = picks['sta_ot']
+        ot_i = ots[np.argmax(num_nbr)]
+        to_assoc_idx = np.where(abs(ots-ot_i) < associator.ot_dev)[0]
+        event_loc, event_pick, assoc_idx, drop_idx = associator.assoc_loc(picks[to_assoc_idx])
+        if len(event_loc)>0: events_ot.append(event_loc['evt_ot'])
+        drop_idx = np.array(drop_idx, dtype=np.int32) + to_assoc_idx[0]
+        assoc_idx = np.array(assoc_idx, dtype=np.int32) + to_assoc_idx[0]
+        num_drop[drop_idx] += 1
+        to_del = np.unique(np.concatenate([assoc_idx, np.where(num_drop > associator.max_drop)[0]]))
+        to_renew_idx = np.where(abs(ots-ot_i) < 2*associator.ot_dev)[0]
+        for idx in to_renew_idx:
+            num_nbr[idx] -= sum(abs(ots[to_del]-ots[idx]) < associator.ot_dev)
+        picks = np.delete(picks, to_del)
+        num_nbr = np.delete(num_nbr, to_del)
+        num_drop = np.delete(num_drop, to_del)
+    return events_ot
+
+def bench_assoc(num_picks_list=[1000,5000,20000,50000,200000], max_loop_picks=20000, num_sta=50):
+    print('assoc ot clustering: picks per day')
+    dtype = picker_pal.STA_LTA_Kurtosis.pick_dtype
+    sta_dict = {'XX.S%s'%ii: [0., 0., 0., 1.] for ii in range(num_sta)}
+    associator = OT_Assoc(sta_dict, ot_dev=2., min_sta=4, max_drop=1)
+    for num_picks in num_picks_list:
+        # half picks clustered in events, half random
+        num_evt = num_picks // 20
+        evt_ot = np.random.uniform(0, 86400, num_evt)
+        sta_ot = np.concatenate([np.repeat(evt_ot, 10) + np.random.randn(num_evt*10)*0.3,
+                                 np.random.uniform(0, 86400, num_picks - num_evt*10)])
+        picks = np.zeros(num_picks, dtype=dtype)
+        picks['sta_idx'] = np.random.randint(0, num_sta, num_picks)
+        picks['sta_ot'] = sta_ot
+        picks['tp'], picks['ts'] = sta_ot + 5., sta_ot + 10.
+        t = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            events_loc, _ = associator.associate(picks)
+        t_new = time.time() - t
+        if num_picks > max_loop_picks:
+            print('  {:>6} picks | {:>5} events | sorted {:.2f}s'.format(num_picks, len(events_loc), t_new))
+            continue
+        t = time.time()
+        events_ot = associate_loop(associator, picks)
+        t_loop = time.time() - t
+        is_same = events_ot == [event_loc['evt_ot'] for event_loc in events_loc]
+        print('  {:>6} picks | {:>5} events | loop {:.2f}s | sorted {:.2f}s | same output {}'\
+            .format(num_picks, len(events_loc), t_loop, t_new, is_same))
+
+def bench_kurtosis(num_trig=20, samp_rate=100, win_kurt=[5.,1.], s_win=10.):
+    print('kurtosis: %s triggers'%num_trig)
+    picker = picker_pal.STA_LTA_Kurtosis()
+    win_kurt_npts = [int(samp_rate * win) for win in win_kurt]
+    npts = int(samp_rate * s_win)
+    data_list = []
+    for _ in range(num_trig):
+        data = np.random.randn(npts + win_kurt_npts[0])**2
+        data[npts//2:] *= 20  # energy jump as S arrival
+        data_list.append(data / np.amax(data))
+    for win_npts in win_kurt_npts:
+        t = time.time()
+        kurt_loop = [calc_kurtosis_loop(data, win_npts) for data in data_list]
+        t_loop = time.time() - t
+        t = time.time()
+        kurt_vec = [picker.calc_kurtosis(data, win_npts) for data in data_list]
+        t_vec = time.time() - t
+        max_dev = max([np.amax(abs(k0-k1)) for k0,k1 in zip(kurt_loop, kurt_vec)])
+        print('  win {} npts | loop {:.3f}s | vectorized {:.4f}s | x{:.0f} | max dev {:.2e}'\
+            .format(win_npts, t_loop, t_vec, t_loop/t_vec, max_dev))
+
+def bench_pca(num_trig=50, samp_rate=100, pca_win=1., pca_range=[0.,2.], trace_len=3600.):
+    print('pca filter: %s triggers'%num_trig)
+    picker = picker_pal.STA_LTA_Kurtosis()
+    pca_win_npts = int(samp_rate * pca_win)
+    pca_range_npts = [int(samp_rate * win) for win in pca_range]
+    st_data = np.random.randn(3, int(samp_rate * trace_len))
+    tp_idxs = np.random.randint(pca_win_npts, st_data.shape[1] - 2*sum(pca_range_npts), num_trig)
+    t = time.time()
+    pca_loop = [calc_pca_filter_loop(picker, st_data, tp_idx, pca_range_npts, pca_win_npts) for tp_idx in tp_idxs]
+    t_loop = time.time() - t
+    t = time.time()
+    pca_vec = [picker.calc_pca_filter(st_data, tp_idx, pca_range_npts, pca_win_npts) for tp_idx in tp_idxs]
+    t_vec = time.time() - t
+    t = time.time()
+    pol = picker.calc_pol_trace(st_data, pca_win_npts)
+    t_pol = time.time() - t
+    t = time.time()
+    pca_trace = [picker.calc_pca_filter(st_data, tp_idx, pca_range_npts, pca_win_npts, pol) for tp_idx in tp_idxs]
+    t_trace = time.time() - t
+    max_dev = max([np.amax(abs(p0-p1)) for p0,p1 in zip(pca_loop, pca_vec)])
+    max_dev_trace = max([np.amax(abs(p0-p1)) for p0,p1 in zip(pca_loop, pca_trace)])
+    print('  loop {:.3f}s | batched {:.4f}s | x{:.0f} | max dev {:.2e}'\
+        .format(t_loop, t_vec, t_loop/t_vec, max_dev))
+    print('  trace pol ({:.0f}s) {:.3f}s + lookup {:.4f}s | max dev {:.2e}'\
+        .format(trace_len, t_pol, t_trace, max_dev_trace))
+
+def bench_prep(trace_len=86400., samp_rate=100, out_rate=50, freq_band=[1,20], num_gap=100):
+    print('preprocess: {:.0f}s 3-chn trace, {} gaps'.format(trace_len, num_gap))
+    npts = int(samp_rate * trace_len)
+    data = np.random.randn(3, npts) * 1e3
+    for idx in np.random.randint(0, npts-1000, num_gap): data[:, idx:idx+np.random.randint(10,1000)] = 0
+    stream = Stream([Trace(data[ii].copy(), header={'sampling_rate':samp_rate}) for ii in range(3)])
+    # obspy stream chain (gap fill not included)
+    t = time.time()
+    st = stream.copy().detrend('demean').detrend('linear').taper(max_percentage=0.05, max_length=5.)
+    st = st.filter('bandpass', freqmin=freq_band[0], freqmax=freq_band[1])
+    t_obspy = time.time() - t
+    t = time.time()
+    prep_data = preprocess_lib.stream2data(stream)
+    prep_data = preprocess_lib.preprocess(prep_data, samp_rate, freq_band, max_gap=None)
+    t_prep = time.time() - t
+    st_data = np.array([tr.data for tr in st])
+    max_dev = np.amax(abs(prep_data - st_data)) / np.amax(abs(st_data))
+    print('  obspy {:.2f}s | engine (float32) {:.2f}s | max rel dev {:.2e}'.format(t_obspy, t_prep, max_dev))
+    t = time.time()
+    preprocess_lib.fill_gap(preprocess_lib.stream2data(stream), int(5*samp_rate))
+    print('  gap fill {:.3f}s'.format(time.time() - t))
+    t = time.time()
+    st = stream.copy().resample(out_rate)
+    t_obspy = time.time() - t
+    t = time.time()
+    preprocess_lib.resample(preprocess_lib.stream2data(stream), samp_rate, out_rate)
+    print('  resample to {}Hz: obspy {:.2f}s | engine {:.2f}s'.format(out_rate, t_obspy, time.time() - t))
+    t = time.time()
+    poly_data = resample_poly(data, out_rate, samp_rate, axis=-1)
+    t_poly = time.time() - t
+    t = time.time()
+    block_data = preprocess_lib.resample_block(data, samp_rate, out_rate, int(3600*out_rate))
+    t_block = time.time() - t
+    print('  polyphase: whole trace {:.2f}s | 1h blocks {:.2f}s | max dev {:.2e}'\
+        .format(t_poly, t_block, np.amax(abs(poly_data - block_data))))
+
+def bench_workers(num_workers_list=[1,2,4,8], trig_thres=4.):
+    stream = make_stream(np.random.default_rng(0), trace_len=7200., num_evt=300)
+    print('trigger eval threads: {:.0f}s trace'.format(stream[0].stats.endtime - stream[0].stats.starttime))
+    picks_serial = None
+    for num_workers in num_workers_list:
+        picker = picker_pal.STA_LTA_Kurtosis(num_workers=num_workers, trig_thres=trig_thres, to_prep=False)
+        t = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            picks = picker.pick(stream)
+        dt = time.time() - t
+        if picks_serial is None: picks_serial, t_serial = picks, dt
+        print('  {} threads | {} picks | {:.2f}s | x{:.2f} | same picks {}'.format(num_workers, len(picks), dt, \
+            t_serial/dt, np.array_equal(picks, picks_serial)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--target', type=str, default='all')
+    args = parser.parse_args()
+    np.random.seed(0)
+    if args.target in ['kurtosis','all']: bench_kurtosis()
+    if args.target in ['pca','all']: bench_pca()
+    if args.target in ['assoc','all']: bench_assoc()
+    if args.target in ['prep','all']: bench_prep()
+    if args.target in ['workers','all']: bench_workers()
@@ -4,6 +4,7 @@ import os, glob
 import numpy as np
 import obspy
 from obspy import read, UTCDateTime
+import picker_pal
 
 # get data path dict
 def get_data_dict(date, data_dir):
@@ -37,14 +38,14 @@ def get_1chn_data(date, data_dir):
         if len(data_dict[net_sta])!=3: data_dict[net_sta] = [data_dict[net_sta][-1]]*3
     return data_dict
 
-# read stream data
-def read_data(st_paths, sta_dict):
+# read stream data, in [starttime, endtime] if given (headers only with headonly)
+def read_data(st_paths, sta_dict, starttime=None, endtime=None, headonly=False):
     # read data
     print('reading stream: {}'.format(st_paths[0]))
     try:
-        st  = read(st_paths[0])
-        st += read(st_paths[1])
-        st += read(st_paths[2])
+        st  = read(st_paths[0], starttime=starttime, endtime=endtime, headonly=headonly)
+        st += read(st_paths[1], starttime=starttime, endtime=endtime, headonly=headonly)
+        st += read(st_paths[2], starttime=starttime, endtime=endtime, headonly=headonly)
     except: 
         print('bad data!'); return []
     # change header
@@ -93,13 +94,10 @@ def get_sta_dict(sta_file):
     return sta_dict
 
 # get PAL picks (for assoc)
-def get_pal_picks(date, pick_dir):
+def get_pal_picks(date, pick_dir, sta_dict):
     picks = []
-    dtype = [('net_sta','O'),
-             ('sta_ot','O'),
-             ('tp','O'),
-             ('ts','O'),
-             ('s_amp','O')]
+    dtype = picker_pal.STA_LTA_Kurtosis.pick_dtype
+    sta_idx_dict = {net_sta: ii for ii, net_sta in enumerate(sta_dict)}
     fname = str(date.date) + '.pick'
     pick_path = os.path.join(pick_dir, fname)
     if not os.path.exists(pick_path): return np.array([], dtype=dtype)
@@ -107,29 +105,29 @@ def get_pal_picks(date, pick_dir):
     for line in lines:
         codes = line.split(',')
         net_sta = codes[0]
-        sta_ot, tp, ts = [UTCDateTime(code) for code in codes[1:4]]
+        if net_sta not in sta_idx_dict: continue
+        sta_ot, tp, ts = [UTCDateTime(code).timestamp for code in codes[1:4]]
         s_amp = float(codes[4])
-        picks.append((net_sta, sta_ot, tp, ts, s_amp))
+        picks.append((sta_idx_dict[net_sta], sta_ot, tp, ts, s_amp))
     return np.array(picks, dtype=dtype)
 
 # get picks (for assoc)
-def get_picks(date, pick_dir):
+def get_picks(date, pick_dir, sta_dict):
     picks = []
-    dtype = [('net_sta','O'),
-             ('sta_ot','O'),
-             ('tp','O'),
-             ('ts','O'),
-             ('s_amp','O')]
+    dtype = picker_pal.STA_LTA_Kurtosis.pick_dtype
+    sta_idx_dict = {net_sta: ii for ii, net_sta in enumerate(sta_dict)}
     fname = str(date.date) + '.pick'
     pick_path = os.path.join(pick_dir, fname)
+    if not os.path.exists(pick_path): return np.array([], dtype=dtype)
     f=open(pick_path); lines=f.readlines(); f.close()
     for line in lines:
         codes = line.split(',')
         net_sta = codes[0]
-        tp, ts = [UTCDateTime(code) for code in codes[1:3]]
+        if net_sta not in sta_idx_dict: continue
+        tp, ts = [UTCDateTime(code).timestamp for code in codes[1:3]]
         sta_ot = calc_ot(tp, ts)
         s_amp = float(codes[3])
-        picks.append((net_sta, sta_ot, tp, ts, s_amp))
+        picks.append((sta_idx_dict[net_sta], sta_ot, tp, ts, s_amp))
     return np.array(picks, dtype=dtype)
 
 def calc_ot(tp, ts):
@@ -1,5 +1,8 @@
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from scipy.stats import kurtosis
+from scipy.signal import sosfilt
+import preprocess_lib
 
 class STA_LTA_Kurtosis(object):
   """ STA/LTA & kurtosis-based P&S Picker
@@ -13,6 +16,7 @@ class STA_LTA_Kurtosis(object):
     p_win, s_win: win len for searching P & S
     pca_win: time win for calc pca filter
     pca_range: time range for pca filter
+    pca_cache: whether to precompute pca pol for the whole trace
     win_kurt: win for calc kurtosis
     amp_ratio_thres: max value of amp ratio, peak_rm, P/P_tail, & P/S
     fd_trhes: min value of dominant frequency
@@ -20,14 +24,34 @@ class STA_LTA_Kurtosis(object):
     det_gap: time gap between detections
     to_prep: whether preprocess stream
     freq_band: frequency band for phase picking
+    num_workers: num of threads to eval triggers (1 for serial)
+    *note: threads only overlap the GIL-free numpy work of eval_trig, & are often slower than serial on short wins;
+      keep 1 unless benchmark.py --target=workers shows a gain, & use a station pool for more cores
+    early_reject: whether to run P-side QC (fd on P win & P peak amp ratio) before S picking
+    *note: with early_reject, triggers rejected on P side only hold det_gap from tp (no ts)
+    *note: QC rejection counts of the last pick run are in picker.qc_counts
+    chunk_len: len of chunk for bounded-memory picking (None for whole trace)
+    chunk_pad: data padded on both sides of a chunk (should cover win_lta, s_win & taper)
+    *note: in chunk mode, a trigger is owned by the chunk holding it; det_gap carries over chunks
+    *note: in chunk mode, preprocess (gap fill, missed chn fix, detrend & taper) runs on each padded chunk,
+      so picks near gaps, dead chn & chunk edges (within taper) may differ from whole-trace picking
+    *note: to bound memory of raw data too, pass read_chunk(t0, t1) to read each chunk (stream may be headers only)
     *note: all time-related params are in sec
   Outputs
     output to file or picks (struct np.array)
+    *note: pick times are epoch sec (float64); sta_idx is the station index in sta_dict
   Usage
     import picker_pal
     picker = picker_pal.STA_LTA_Kurtosis()
-    picks = picker.pick(stream)
+    picks = picker.pick(stream, sta_idx=sta_idx)
   """
+  # output format for picks
+  pick_dtype = [('sta_idx',np.int32),
+                ('sta_ot',np.float64),
+                ('tp',np.float64),
+                ('ts',np.float64),
+                ('s_amp',np.float64)]
+
   def __init__(self, 
                win_sta         = [.8, 0.4, 1.],
                win_lta         = [6., 2., 2.],
@@ -36,6 +60,7 @@ class STA_LTA_Kurtosis(object):
                s_win           = 10,
                pca_win         = 1.,
                pca_range       = [0., 2],
+               pca_cache       = False,
                win_kurt        = [5.,1.],
                fd_thres        = 2.5, 
                amp_ratio_thres = [6,10,2], 
@@ -44,7 +69,11 @@ class STA_LTA_Kurtosis(object):
                to_prep         = True,
                freq_band       = [1., 40],
                vp              = 6.0,
-               vs              = 3.45):
+               vs              = 3.45,
+               num_workers     = 1,
+               early_reject    = False,
+               chunk_len       = None,
+               chunk_pad       = 60.):
     self.win_sta = win_sta
     self.win_lta = win_lta
     self.trig_thres = trig_thres
@@ -52,6 +81,7 @@ class STA_LTA_Kurtosis(object):
     self.s_win = s_win
     self.pca_win = pca_win
     self.pca_range = pca_range
+    self.pca_cache = pca_cache
     self.win_kurt = win_kurt
     self.fd_thres = fd_thres
     self.amp_ratio_thres = amp_ratio_thres
@@ -61,126 +91,222 @@ class STA_LTA_Kurtosis(object):
     self.freq_band = freq_band
     self.vp = vp
     self.vs = vs
+    self.num_workers = num_workers
+    self.early_reject = early_reject
+    self.chunk_len = chunk_len
+    self.chunk_pad = chunk_pad
+
+  def pick(self, stream, out_file=None, sta_idx=-1, read_chunk=None):
+    # pick the whole trace, or chunk by chunk to bound memory
+    if self.chunk_len: return self.pick_chunks(stream, out_file, sta_idx, read_chunk)
+    picks, _, self.qc_counts = self.pick_seg(stream, out_file, sta_idx)
+    return picks
+
+  # pick in chunks of chunk_len with chunk_pad on both sides, read by read_chunk or sliced from the raw stream
+  def pick_chunks(self, stream, out_file=None, sta_idx=-1, read_chunk=None):
+    if len(stream)!=3:
+        picks, _, self.qc_counts = self.pick_seg(stream, out_file, sta_idx)
+        return picks
+    start_time = max([trace.stats.starttime for trace in stream])
+    end_time = min([trace.stats.endtime for trace in stream])
+    num_chunks = max(1, int(np.ceil((end_time - start_time) / self.chunk_len)))
+    picks, t_hold, self.qc_counts = [], None, {}
+    for chunk_idx in range(num_chunks):
+        t0 = start_time + chunk_idx*self.chunk_len
+        t1 = t0 + self.chunk_len
+        print('chunk {}/{}: {} to {}'.format(chunk_idx+1, num_chunks, t0, t1))
+        if read_chunk: chunk = read_chunk(t0 - self.chunk_pad, t1 + self.chunk_pad)
+        else: chunk = stream.slice(t0 - self.chunk_pad, t1 + self.chunk_pad)
+        picks_i, t_hold, qc_counts = self.pick_seg(chunk, out_file, sta_idx, [t0.timestamp, t1.timestamp], t_hold,
+            [start_time, end_time])
+        picks.append(picks_i)
+        for qc_name, num in qc_counts.items(): 
+            self.qc_counts[qc_name] = self.qc_counts.get(qc_name, 0) + num
+    return np.concatenate(picks)
 
-  def pick(self, stream, out_file=None):
-    # set output format for picks
-    dtype = [('net_sta','O'),
-             ('sta_ot','O'),
-             ('tp','O'),
-             ('ts','O'),
-             ('s_amp','O')]
+  # pick one segment of stream
+  #   trig_win: only triggers in [t0, t1) are picked (None for all)
+  #   t_hold: triggers before t_hold are skipped (det_gap of last segment)
+  #   t_ref: start & end time of the whole trace, so that windows snap to samples as on the whole trace
+  #   return picks, t_hold of this segment, & QC rejection counts
+  def pick_seg(self, stream, out_file=None, sta_idx=-1, trig_win=None, t_hold=None, t_ref=None):
+    dtype = self.pick_dtype
     # preprocess & extract data
-    if len(stream)!=3: return np.array([], dtype=dtype)
+    qc_counts = {qc_name: 0 for qc_name in ['p_fd','p_amp','fd','amp_ratio','A12','A13']}
+    if len(stream)!=3: return np.array([], dtype=dtype), t_hold, qc_counts
     if self.to_prep: stream = self.preprocess(stream, self.freq_band)
-    if len(stream)!=3: return np.array([], dtype=dtype)
+    if len(stream)!=3: return np.array([], dtype=dtype), t_hold, qc_counts
     min_npts = min([len(trace) for trace in stream])
-    st_data = np.array([trace.data[0:min_npts] for trace in stream])
+    st_data = np.array([trace.data[0:min_npts] for trace in stream], dtype=np.float64)
     # get header
     head = stream[0].stats
     net_sta = '.'.join([head.network, head.station])
     samp_rate = head.sampling_rate
     start_time, end_time = head.starttime, head.endtime
-    # sec to points
-    win_sta_npts   = [int(samp_rate * win) for win in self.win_sta]
-    win_lta_npts   = [int(samp_rate * win) for win in self.win_lta]
-    p_win_npts     = [int(samp_rate * win) for win in self.p_win]
-    s_win_npts     =  int(samp_rate * self.s_win)
-    pca_win_npts   =  int(samp_rate * self.pca_win)
-    pca_range_npts = [int(samp_rate * win) for win in self.pca_range]
-    win_kurt_npts  = [int(samp_rate * win) for win in self.win_kurt]
-    amp_win_npts   = [int(samp_rate * win) for win in self.amp_win]
-    det_gap_npts   =  int(samp_rate * self.det_gap)
+    # trace-level data & derived series, shared by all triggers
+    trace = {'st_data':st_data, 'start_time':start_time, 'end_time':end_time, 'samp_rate':samp_rate, 't_ref':t_ref}
+    trace['npts'] = self.get_npts(samp_rate)
+    win_sta_npts, win_lta_npts, p_win_npts, _, pca_win_npts, _, _, _, det_gap_npts = trace['npts']
+    trace['pol'] = self.calc_pol_trace(st_data, pca_win_npts) if self.pca_cache else None
+    trace['eng_h'], trace['eng_z'], trace['cum_velo'] = self.calc_trace_cache(st_data)
     # pick P and S
     picks = []
     # 1. trig picker
     print('1. triggering phase picker')
-    cf_trig = self.calc_sta_lta(st_data[2]**2, win_lta_npts[0], win_sta_npts[0])
-    trig_index = np.where(cf_trig > self.trig_thres)[0]
-    slide_idx = 0
+    trace['cf_trig'] = self.calc_sta_lta(trace['eng_z'], win_lta_npts[0], win_sta_npts[0])
+    trig_index = np.where(trace['cf_trig'] > self.trig_thres)[0]
+    # keep triggers in trig_win & after t_hold (half sample tolerance)
+    if trig_win:
+        trig_time = start_time.timestamp + trig_index/samp_rate
+        half_dt = 0.5/samp_rate
+        to_keep = (trig_time >= trig_win[0]-half_dt) * (trig_time < trig_win[1]-half_dt)
+        if t_hold: to_keep *= trig_time > t_hold+half_dt
+        trig_index = trig_index[to_keep]
     # 2. phase picking
     print('2. picking phase:')
+    trig_res = {}
+    if self.num_workers>1 and len(trig_index)>0:
+        # 2.1 eval candidate triggers (first of each trig run) in parallel
+        #   candidates the serial run would skip may fail (e.g. near trace end): keep the error, raise only if replayed
+        trig_cand = trig_index[np.concatenate([[0], np.where(np.diff(trig_index)>1)[0]+1])]
+        def eval_cand(trig_idx):
+            try: return self.eval_trig(trace, trig_idx)
+            except Exception as err: return err
+        with ThreadPoolExecutor(self.num_workers) as executor:
+            trig_res = dict(zip(trig_cand, executor.map(eval_cand, trig_cand)))
+    # 2.2 replay det_gap rule in time order (same picks as serial run)
+    slide_idx = 0
     for _ in trig_index:
         trig_idx = trig_index[slide_idx]
-        if trig_idx < p_win_npts[0] + max(win_lta_npts):
-            slide_idx += 1; continue
-        # 2.1 pick P with STA/LTA
-        p_idx0 = trig_idx - p_win_npts[0] - win_lta_npts[1]
-        p_idx1 = trig_idx + p_win_npts[1] + win_sta_npts[1]
-        data_p = st_data[2,p_idx0:p_idx1]**2
-        cf_p = self.calc_sta_lta(data_p, win_lta_npts[1], win_sta_npts[1])
-        tp0_idx = np.argmax(cf_p) + p_idx0
-        # refine initial pick on waveform
-        tp_idx = tp0_idx - self.find_second_peak(data_p[0:tp0_idx-p_idx0][::-1])
-        tp = start_time + tp_idx/samp_rate
-        # 2.2 pick S 
-        # 2.2.1 pca for amp_peak
-        if len(st_data[0]) < tp_idx + s_win_npts: break
-        s_idx0 = tp_idx - pca_range_npts[0]
-        s_idx1 = max(tp_idx + s_win_npts, tp_idx + pca_range_npts[1])
-        data_s = np.sum(st_data[0:2, s_idx0:s_idx1]**2, axis=0)**0.5
-        pca_filter = self.calc_pca_filter(st_data, tp_idx, pca_range_npts, pca_win_npts)
-        data_s[0:len(pca_filter)] *= pca_filter
-        dt_peak = max(np.argmax(data_s)+1, pca_win_npts+1)
-        # 2.2.2 long_win kurt --> t_max
-        s_idx0 = tp_idx + dt_peak//2 - win_kurt_npts[0]
-        s_idx1 = tp_idx + dt_peak
-        data_s = np.sum(st_data[0:2, s_idx0:s_idx1]**2, axis=0)
-        data_s /= np.amax(data_s)
-        kurt_long = self.calc_kurtosis(data_s, win_kurt_npts[0])
-        # 2.2.3 STA/LTA --> t_min
-        s_idx0 = tp_idx + dt_peak//2 - win_lta_npts[2]
-        s_idx1 = tp_idx + dt_peak + win_sta_npts[2]
-        data_s = np.sum(st_data[0:2, s_idx0:s_idx1]**2, axis=0)
-        cf_s = self.calc_sta_lta(data_s, win_lta_npts[2], win_sta_npts[2])[win_lta_npts[2]:]
-        # 2.2.4 pick S on short_win kurt
-        dt_max = np.argmax(kurt_long) # relative to (tp_idx + dt_peak//2)
-        dt_max -= self.find_first_peak(kurt_long[0:dt_max+1][::-1])
-        dt_min = np.argmax(cf_s) # relative to (tp_idx + dt_peak//2)
-        # if kurt_long not stable, use STA/LTA
-        if dt_min>=dt_max: 
-            ts0_idx = tp_idx + dt_peak//2 + dt_min
-            ts_idx = ts0_idx - self.find_second_peak(data_s[0:dt_min+win_lta_npts[2]][::-1])
-        # else, pick peak of kurt_short
-        else:
-            s_idx0 = tp_idx + dt_peak//2 + dt_min - win_kurt_npts[1]
-            s_idx1 = tp_idx + dt_peak//2 + dt_max
-            data_s = np.sum(st_data[0:2, s_idx0:s_idx1]**2, axis=0)
-            data_s /= np.amax(data_s)
-            kurt_short = self.calc_kurtosis(data_s, win_kurt_npts[1])
-            kurt_max = np.argmax(kurt_short) if np.argmax(kurt_short)>0 else dt_max-dt_min
-            ts0_idx = tp_idx + dt_peak//2 + dt_min + kurt_max
-            ts_idx = ts0_idx - self.find_second_peak(data_s[0:s_idx0+win_kurt_npts[1]+kurt_max][::-1])
-        ts = start_time + ts_idx/samp_rate if ts_idx>tp_idx else start_time + ts0_idx/samp_rate
-        # 3. get related S amplitude
-        data_amp = st_data[:, tp_idx-amp_win_npts[0] : ts_idx+amp_win_npts[1]].copy()
-        s_amp = self.get_s_amp(data_amp, samp_rate)
-        # 4. get p_snr
-        p_snr = np.amax(cf_trig[p_idx0:p_idx1])
-        # 5. quality control with dominant freq & amp ratio
-        st = stream.slice(tp, max(tp+(ts-tp)/2, tp+self.pca_win)).copy()
-        fd = max([self.calc_freq_dom(tr.data, samp_rate) for tr in st])
-        p_amp_ratio = self.calc_peak_amp_ratio(stream.slice(tp, tp+self.pca_win*3), pca_win_npts)
-        s_amp_ratio = self.calc_peak_amp_ratio(stream.slice(ts, ts+self.pca_win*3), pca_win_npts)
-        amp_ratio = max(min(p_amp_ratio), min(s_amp_ratio))
-        A1 = np.array([np.amax(tr.data)-np.amin(tr.data) for tr in stream.slice(tp, tp+(ts-tp)/2)])
-        A2 = np.array([np.amax(tr.data)-np.amin(tr.data) for tr in stream.slice(tp+(ts-tp)/2, ts)])
-        A3 = np.array([np.amax(tr.data)-np.amin(tr.data) for tr in stream.slice(ts, ts+(ts-tp)/2)])
-        A12 = min([A1[ii]/A2[ii] for ii in range(3)])
-        A13 = min([A1[ii]/A3[ii] for ii in range(3)])
+        res = trig_res.pop(trig_idx) if trig_idx in trig_res else self.eval_trig(trace, trig_idx)
+        if isinstance(res, Exception): raise res
+        status, tp_idx, ts_idx, pick = res
+        if status=='skip': slide_idx += 1; continue
+        if status=='end': break
         # output picks
-        if fd>self.fd_thres and amp_ratio<self.amp_ratio_thres[0] and A12<self.amp_ratio_thres[1] and A13<self.amp_ratio_thres[2]:
+        if status!='pick': qc_counts[status] += 1
+        else:
+            tp, ts, s_amp, qual_code = pick
             print('{}, {}, {}'.format(net_sta, tp, ts))
             sta_ot = self.calc_ot(tp, ts)
-            picks.append((net_sta, sta_ot, tp, ts, s_amp))
+            picks.append((sta_idx, sta_ot.timestamp, tp.timestamp, ts.timestamp, s_amp))
             if out_file: 
-                qual_code = '{:.1f},{:.1f},{:.1f},{:.1f},{:.1f}'.format(p_snr, fd, amp_ratio, A12, A13)
                 out_file.write('{},{},{},{},{},{}\n'.format(net_sta, sta_ot, tp, ts, s_amp, qual_code))
         # next detected phase
-        rest_det = np.where(trig_index > max(trig_idx,ts_idx,tp_idx) + det_gap_npts)[0]
+        if ts_idx is None: ts_idx = tp_idx
+        hold_idx = max(trig_idx,ts_idx,tp_idx) + det_gap_npts
+        t_hold = start_time.timestamp + hold_idx/samp_rate
+        rest_det = np.where(trig_index > hold_idx)[0]
         if len(rest_det)==0: break
         slide_idx = rest_det[0]
+    print('  {} picks | rejected by QC: {}'.format(len(picks), \
+        ' | '.join(['{} {}'.format(qc_name, num) for qc_name, num in qc_counts.items()])))
     # convert to structed np.array
-    return np.array(picks, dtype=dtype)
+    return np.array(picks, dtype=dtype), t_hold, qc_counts
+
+  # pick P & S of one trigger
+  #   status: 'skip', 'end', 'pick', or name of the QC stage that rejected it
+  #   ts_idx is None if rejected by P-side QC
+  def eval_trig(self, trace, trig_idx):
+    st_data, eng_h, eng_z, cum_velo, pol, cf_trig = \
+        [trace[key] for key in ['st_data','eng_h','eng_z','cum_velo','pol','cf_trig']]
+    start_time, end_time, samp_rate, t_ref = trace['start_time'], trace['end_time'], trace['samp_rate'], trace['t_ref']
+    win_sta_npts, win_lta_npts, p_win_npts, s_win_npts, pca_win_npts, pca_range_npts, win_kurt_npts, amp_win_npts, _ = trace['npts']
+    if trig_idx < p_win_npts[0] + max(win_lta_npts): return 'skip', None, None, None
+    # 1. pick P with STA/LTA
+    p_idx0 = trig_idx - p_win_npts[0] - win_lta_npts[1]
+    p_idx1 = trig_idx + p_win_npts[1] + win_sta_npts[1]
+    data_p = eng_z[p_idx0:p_idx1]
+    cf_p = self.calc_sta_lta(data_p, win_lta_npts[1], win_sta_npts[1])
+    tp0_idx = np.argmax(cf_p) + p_idx0
+    # refine initial pick on waveform
+    tp_idx = tp0_idx - self.find_second_peak(data_p[0:tp0_idx-p_idx0][::-1])
+    tp = start_time + tp_idx/samp_rate
+    # 2. pick S 
+    # 2.1 pca for amp_peak
+    if len(st_data[0]) < tp_idx + s_win_npts: return 'end', tp_idx, None, None
+    # P-side QC first: skip S picking for rejected triggers
+    p_amp_ratio = None
+    if self.early_reject:
+        data_fd = self.slice_data(st_data, start_time, end_time, samp_rate, tp, tp+self.pca_win, t_ref).copy()
+        if max([self.calc_freq_dom(data, samp_rate) for data in data_fd]) <= self.fd_thres: 
+            return 'p_fd', tp_idx, None, None
+        p_amp_ratio = self.calc_peak_amp_ratio(self.slice_data(st_data, start_time, end_time, samp_rate, tp, tp+self.pca_win*3, t_ref), pca_win_npts)
+        if min(p_amp_ratio) >= self.amp_ratio_thres[0]: return 'p_amp', tp_idx, None, None
+    s_idx0 = tp_idx - pca_range_npts[0]
+    s_idx1 = max(tp_idx + s_win_npts, tp_idx + pca_range_npts[1])
+    data_s = eng_h[s_idx0:s_idx1]**0.5
+    pca_filter = self.calc_pca_filter(st_data, tp_idx, pca_range_npts, pca_win_npts, pol)
+    data_s[0:len(pca_filter)] *= pca_filter
+    dt_peak = max(np.argmax(data_s)+1, pca_win_npts+1)
+    # 2.2 long_win kurt --> t_max
+    s_idx0 = tp_idx + dt_peak//2 - win_kurt_npts[0]
+    s_idx1 = tp_idx + dt_peak
+    data_s = eng_h[s_idx0:s_idx1] / np.amax(eng_h[s_idx0:s_idx1])
+    kurt_long = self.calc_kurtosis(data_s, win_kurt_npts[0])
+    # 2.3 STA/LTA --> t_min
+    s_idx0 = tp_idx + dt_peak//2 - win_lta_npts[2]
+    s_idx1 = tp_idx + dt_peak + win_sta_npts[2]
+    data_s = eng_h[s_idx0:s_idx1]
+    cf_s = self.calc_sta_lta(data_s, win_lta_npts[2], win_sta_npts[2])[win_lta_npts[2]:]
+    # 2.4 pick S on short_win kurt
+    dt_max = np.argmax(kurt_long) # relative to (tp_idx + dt_peak//2)
+    dt_max -= self.find_first_peak(kurt_long[0:dt_max+1][::-1])
+    dt_min = np.argmax(cf_s) # relative to (tp_idx + dt_peak//2)
+    # if kurt_long not stable, use STA/LTA
+    if dt_min>=dt_max: 
+        ts0_idx = tp_idx + dt_peak//2 + dt_min
+        ts_idx = ts0_idx - self.find_second_peak(data_s[0:dt_min+win_lta_npts[2]][::-1])
+    # else, pick peak of kurt_short
+    else:
+        s_idx0 = tp_idx + dt_peak//2 + dt_min - win_kurt_npts[1]
+        s_idx1 = tp_idx + dt_peak//2 + dt_max
+        data_s = eng_h[s_idx0:s_idx1] / np.amax(eng_h[s_idx0:s_idx1])
+        kurt_short = self.calc_kurtosis(data_s, win_kurt_npts[1])
+        kurt_max = np.argmax(kurt_short) if np.argmax(kurt_short)>0 else dt_max-dt_min
+        ts0_idx = tp_idx + dt_peak//2 + dt_min + kurt_max
+        ts_idx = ts0_idx - self.find_second_peak(data_s[0:s_idx0+win_kurt_npts[1]+kurt_max][::-1])
+    ts = start_time + ts_idx/samp_rate if ts_idx>tp_idx else start_time + ts0_idx/samp_rate
+    # 3. get related S amplitude
+    amp_idx0, amp_idx1 = max(0, tp_idx-amp_win_npts[0]), min(len(eng_z), ts_idx+amp_win_npts[1])
+    s_amp = self.get_s_amp_cum(cum_velo, amp_idx0, amp_idx1, samp_rate)
+    # 4. get p_snr
+    p_snr = np.amax(cf_trig[p_idx0:p_idx1])
+    # 5. quality control with dominant freq & amp ratio (on st_data, same samples as stream.slice)
+    t_mid = tp+(ts-tp)/2
+    data_fd = self.slice_data(st_data, start_time, end_time, samp_rate, tp, max(t_mid, tp+self.pca_win), t_ref).copy()
+    fd = max([self.calc_freq_dom(data, samp_rate) for data in data_fd])
+    if p_amp_ratio is None:
+        p_amp_ratio = self.calc_peak_amp_ratio(self.slice_data(st_data, start_time, end_time, samp_rate, tp, tp+self.pca_win*3, t_ref), pca_win_npts)
+    s_amp_ratio = self.calc_peak_amp_ratio(self.slice_data(st_data, start_time, end_time, samp_rate, ts, ts+self.pca_win*3, t_ref), pca_win_npts)
+    amp_ratio = max(min(p_amp_ratio), min(s_amp_ratio))
+    A1 = np.ptp(self.slice_data(st_data, start_time, end_time, samp_rate, tp, t_mid, t_ref), axis=1)
+    A2 = np.ptp(self.slice_data(st_data, start_time, end_time, samp_rate, t_mid, ts, t_ref), axis=1)
+    A3 = np.ptp(self.slice_data(st_data, start_time, end_time, samp_rate, ts, ts+(ts-tp)/2, t_ref), axis=1)
+    A12 = min([A1[ii]/A2[ii] for ii in range(3)])
+    A13 = min([A1[ii]/A3[ii] for ii in range(3)])
+    qc_list = [('fd', fd>self.fd_thres), 
+               ('amp_ratio', amp_ratio<self.amp_ratio_thres[0]), 
+               ('A12', A12<self.amp_ratio_thres[1]), 
+               ('A13', A13<self.amp_ratio_thres[2])]
+    for qc_name, is_pass in qc_list:
+        if not is_pass: return qc_name, tp_idx, ts_idx, None
+    qual_code = '{:.1f},{:.1f},{:.1f},{:.1f},{:.1f}'.format(p_snr, fd, amp_ratio, A12, A13)
+    return 'pick', tp_idx, ts_idx, (tp, ts, s_amp, qual_code)
+
+  # sec to points
+  def get_npts(self, samp_rate):
+    win_sta_npts   = [int(samp_rate * win) for win in self.win_sta]
+    win_lta_npts   = [int(samp_rate * win) for win in self.win_lta]
+    p_win_npts     = [int(samp_rate * win) for win in self.p_win]
+    s_win_npts     =  int(samp_rate * self.s_win)
+    pca_win_npts   =  int(samp_rate * self.pca_win)
+    pca_range_npts = [int(samp_rate * win) for win in self.pca_range]
+    win_kurt_npts  = [int(samp_rate * win) for win in self.win_kurt]
+    amp_win_npts   = [int(samp_rate * win) for win in self.amp_win]
+    det_gap_npts   =  int(samp_rate * self.det_gap)
+    return win_sta_npts, win_lta_npts, p_win_npts, s_win_npts, pca_win_npts, pca_range_npts, \
+        win_kurt_npts, amp_win_npts, det_gap_npts
 
   # calc STA/LTA for a trace of data (abs or square)
   def calc_sta_lta(self, data, win_lta_npts, win_sta_npts):
@@ -202,18 +328,55 @@ class STA_LTA_Kurtosis(object):
     return sta_lta
 
   # calc P wave filter
-  def calc_pca_filter(self, data, idx_p, pca_range_npts, pca_win_npts):
-    p_mat = data[:, idx_p : idx_p + pca_win_npts]
-    p_r, p_v = self.calc_pol(p_mat)
-    idx_range = range(idx_p - pca_range_npts[0],
-                      idx_p + pca_range_npts[1])
-    pca_filter = np.zeros(len(idx_range))
-    for i, idx in enumerate(idx_range):
-        s_mat = data[:, idx : idx + pca_win_npts]
-        s_r, s_v = self.calc_pol(s_mat)
-        abs_cos = abs(np.dot(p_v, s_v))
-        pca_filter[i] = 1 - s_r * abs_cos
-    return pca_filter
+  def calc_pca_filter(self, data, idx_p, pca_range_npts, pca_win_npts, pol=None):
+    idx0 = idx_p - pca_range_npts[0]
+    idx1 = idx_p + pca_range_npts[1]
+    # pol of sliding win, from trace-level pol or calc locally
+    if pol is not None:
+        pol_rate, pol_vec = pol[0][idx0:idx1], pol[1][idx0:idx1]
+        p_v = pol[1][idx_p]
+    else:
+        pol_idx0, pol_idx1 = min(idx0, idx_p), max(idx1, idx_p+1)
+        pol_rate, pol_vec = self.calc_pol_series(data, pol_idx0, pol_idx1, pca_win_npts)
+        p_v = pol_vec[idx_p-pol_idx0]
+        pol_rate, pol_vec = pol_rate[idx0-pol_idx0:], pol_vec[idx0-pol_idx0:]
+    abs_cos = abs(np.dot(pol_vec, p_v))
+    return 1 - pol_rate * abs_cos
+
+  # calc pol_rate & pol_vec for all sliding win starting in [idx0, idx1)
+  def calc_pol_series(self, data, idx0, idx1, pca_win_npts):
+    num_win = idx1 - idx0
+    win_data = data[:, idx0 : idx1+pca_win_npts-1]
+    win_data = win_data - np.mean(win_data, axis=1).reshape(-1,1)
+    # sliding 3x3 cov from cumsum of x_i & x_i*x_j
+    cum_x = np.zeros([3, win_data.shape[1]+1])
+    cum_x[:,1:] = np.cumsum(win_data, axis=1)
+    sum_x = cum_x[:, pca_win_npts:] - cum_x[:, :num_win]
+    cov = np.zeros([num_win, 3, 3])
+    for ii in range(3):
+        for jj in range(ii, 3):
+            cum_xx = np.concatenate([[0.], np.cumsum(win_data[ii]*win_data[jj])])
+            sum_xx = cum_xx[pca_win_npts:] - cum_xx[:num_win]
+            cov[:,ii,jj] = (sum_xx - sum_x[ii]*sum_x[jj]/pca_win_npts) / (pca_win_npts-1)
+            cov[:,jj,ii] = cov[:,ii,jj]
+    # batched eigh: eig_val in ascending order
+    eig_val, eig_vec = np.linalg.eigh(cov)
+    lam1  = abs(eig_val[:,-1])
+    lam23 = abs(np.sum(eig_val, axis=1) - lam1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pol_rate = 1 - (0.5 * lam23 / lam1)
+    pol_vec = eig_vec[:,:,-1]
+    return pol_rate, pol_vec
+
+  # calc pol for the whole trace, in blocks to bound memory & cumsum error
+  def calc_pol_trace(self, data, pca_win_npts, block_npts=100000):
+    num_win = data.shape[1] - pca_win_npts + 1
+    pol_rate = np.zeros(max(num_win,0), dtype=np.float32)
+    pol_vec = np.zeros([max(num_win,0), 3], dtype=np.float32)
+    for idx0 in range(0, num_win, block_npts):
+        idx1 = min(idx0 + block_npts, num_win)
+        pol_rate[idx0:idx1], pol_vec[idx0:idx1] = self.calc_pol_series(data, idx0, idx1, pca_win_npts)
+    return pol_rate, pol_vec
 
   # calc pol_rate & pol_vec
   def calc_pol(self, mat):
@@ -231,6 +394,23 @@ class STA_LTA_Kurtosis(object):
     tt_p = dist / self.vp
     return tp - tt_p
 
+  # horizontal energy, Z energy & cumsum of velocity (with leading 0)
+  def calc_trace_cache(self, st_data):
+    eng_h = st_data[0]**2 + st_data[1]**2
+    eng_z = st_data[2]**2
+    cum_velo = np.zeros([st_data.shape[0], st_data.shape[1]+1])
+    np.cumsum(st_data, axis=1, out=cum_velo[:,1:])
+    return eng_h, eng_z, cum_velo
+
+  # get S amplitude of win [idx0, idx1) with trace-level cumsum of velocity
+  def get_s_amp_cum(self, cum_velo, idx0, idx1, samp_rate):
+    npts = idx1 - idx0
+    # cumsum of demeaned win = cumsum of win - win mean * (1,...,npts)
+    velo_mean = (cum_velo[:, idx1] - cum_velo[:, idx0]) / npts
+    disp = cum_velo[:, idx0+1:idx1+1] - cum_velo[:, idx0:idx0+1] - velo_mean.reshape(-1,1) * np.arange(1, npts+1)
+    disp /= samp_rate
+    return np.amax(abs(np.sum(disp**2, axis=0)))**0.5
+
   # get S amplitide
   def get_s_amp(self, velo, samp_rate):
     # remove mean
@@ -249,30 +429,58 @@ class STA_LTA_Kurtosis(object):
     psd = psd[:npts//2]
     return np.argmax(psd) * samp_rate / npts
 
-  # calc kurtosis trace
-  def calc_kurtosis(self, data, win_kurt_npts):
+  # calc kurtosis trace (sliding moments with cumsum of x, x^2, x^3, x^4)
+  def calc_kurtosis(self, data, win_kurt_npts, min_var_ratio=1e-8):
     npts = len(data) - win_kurt_npts + 1
-    kurt = np.zeros(npts)
-    for i in range(npts):
-        kurt[i] = kurtosis(data[i:i+win_kurt_npts])
+    if npts<=0: return np.zeros(0)
+    # shift by mean to reduce cancellation in raw moments
+    data = np.asarray(data, dtype=np.float64)
+    data_shift = data - np.mean(data)
+    s1, s2, s3, s4 = [np.concatenate([[0.], np.cumsum(data_shift**k)]) for k in range(1,5)]
+    s1, s2, s3, s4 = [(s[win_kurt_npts:] - s[:npts]) / win_kurt_npts for s in [s1,s2,s3,s4]]
+    # central moments from raw moments
+    m2 = s2 - s1**2
+    m4 = s4 - 4*s1*s3 + 6*s1**2*s2 - 3*s1**4
+    # fallback: two-pass kurtosis for ill-conditioned (near-constant) win
+    to_fix = m2 <= min_var_ratio * s2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kurt = m4 / m2**2 - 3.
+    if np.any(to_fix):
+        win_data = np.lib.stride_tricks.sliding_window_view(data, win_kurt_npts)
+        kurt[to_fix] = kurtosis(win_data[to_fix], axis=1)
     return kurt
 
-  def calc_peak_amp_ratio(self, st, win_peak_npts):
+  # data: 3-chn array
+  def calc_peak_amp_ratio(self, data, win_peak_npts):
     # find peak idx
-    peak_data = np.array([abs(tr.data[0:win_peak_npts]) for tr in st])
+    peak_data = abs(data[:, 0:win_peak_npts])
     chn_idx = np.unravel_index(np.argmax(peak_data), peak_data.shape)[0]
-    idx0 = np.argmax(abs(st[chn_idx].data[0:win_peak_npts]))
-    idx1 = idx0 + self.find_first_peak(st[chn_idx].data[idx0:])
-    idx0 -= self.find_second_peak(st[chn_idx].data[0:idx0][::-1])
-    idx1 += self.find_second_peak(st[chn_idx].data[idx1:])+1
+    idx0 = np.argmax(peak_data[chn_idx])
+    idx1 = idx0 + self.find_first_peak(data[chn_idx, idx0:])
+    idx0 -= self.find_second_peak(data[chn_idx, 0:idx0][::-1])
+    idx1 += self.find_second_peak(data[chn_idx, idx1:])+1
     idx0 = max(0,idx0)
     # calc peak amp ratio 
-    amp_ratio = []
-    for tr in st:
-        amp_peak = np.amax(tr.data[idx0:idx1]) - np.amin(tr.data[idx0:idx1])
-        amp_tail = np.amax(tr.data[idx1:2*idx1-idx0]) - np.amin(tr.data[idx1:2*idx1-idx0])
-        amp_ratio.append(amp_peak/amp_tail)
-    return amp_ratio
+    amp_peak = np.ptp(data[:, idx0:idx1], axis=1)
+    amp_tail = np.ptp(data[:, idx1:2*idx1-idx0], axis=1)
+    return list(amp_peak / amp_tail)
+
+  # view of st_data in [t0, t1], with the nearest-sample rule of stream.slice
+  #   t_ref: start & end time of the whole trace (None for st_data), which t0 & t1 snap against
+  def slice_data(self, st_data, start_time, end_time, samp_rate, t0, t1, t_ref=None):
+    # t0 & t1 snap to samples relative to trace start & end
+    #   (rounding of half-sample ties in float depends on the reference time, so use the whole trace)
+    ref_start, ref_end = t_ref if t_ref else (start_time, end_time)
+    shift0 = int(round((start_time - ref_start) * samp_rate))
+    shift1 = int(round((end_time - ref_end) * samp_rate))
+    idx0 = max(0, self.round_away((t0 - ref_start) * samp_rate) - shift0)
+    idx1 = st_data.shape[1] + min(0, self.round_away((t1 - ref_end) * samp_rate) - shift1)
+    return st_data[:, idx0:idx1]
+
+  # round half away from zero, as in obspy trim
+  def round_away(self, x):
+    if np.floor(x)!=np.ceil(x) and x-np.floor(x)==np.ceil(x)-x: return int(x) + int(np.sign(x))
+    return int(np.round(x))
 
   def find_first_peak(self, data):
     npts = len(data)
@@ -303,44 +511,187 @@ class STA_LTA_Kurtosis(object):
     end_time = min([trace.stats.endtime for trace in stream])
     if start_time > end_time: return []
     stream = stream.slice(start_time, end_time, nearest_sample=True)
-    # remove nan & inf
-    for trace in stream:
-        trace.data[np.isnan(trace.data)] = 0
-        trace.data[np.isinf(trace.data)] = 0
+    samp_rate = stream[0].stats.sampling_rate
+    data = preprocess_lib.stream2data(stream)
     # check missed chn
-    if max(stream.max())==0: return []
-    if 0 in stream.max():
-        is_miss = np.array(stream.max())==0
-        for ii in np.where(is_miss)[0]: stream[ii] = stream[np.where(~is_miss)[0][-1]].copy()
-    # fill data gap
-    max_gap_npts = int(max_gap*stream[0].stats.sampling_rate)
-    for trace in stream:
-        data = trace.data
-        npts = len(data)
-        data_diff = np.diff(data)
-        gap_idx = np.where(data_diff==0)[0]
-        gap_list = np.split(gap_idx, np.where(np.diff(gap_idx)!=1)[0] + 1)
-        gap_list = [gap for gap in gap_list if len(gap)>=3]
-        num_gap = len(gap_list)
-        for ii,gap in enumerate(gap_list):
-            idx0, idx1 = max(0, gap[0]-1), min(npts-1, gap[-1]+1)
-            if ii<num_gap-1: idx2 = min(idx1+(idx1-idx0), idx1+max_gap_npts, gap_list[ii+1][0])
-            else: idx2 = min(idx1+(idx1-idx0), idx1+max_gap_npts, npts-1)
-            if idx1==idx2: continue
-            if idx2==idx1+(idx1-idx0): data[idx0:idx1] = data[idx1:idx2]
-            else:
-                num_tile = int(np.ceil((idx1-idx0)/(idx2-idx1)))
-                data[idx0:idx1] = np.tile(data[idx1:idx2], num_tile)[0:idx1-idx0]
-        trace.data = data
-    # filter
-    stream.detrend('demean').detrend('linear').taper(max_percentage=0.05, max_length=5.)
-    freq_min, freq_max = freq_band
-    if freq_min and freq_max:
-        return stream.filter('bandpass', freqmin=freq_min, freqmax=freq_max)
-    elif not freq_max and freq_min:
-        return stream.filter('highpass', freq=freq_min)
-    elif not freq_min and freq_max:
-        return stream.filter('lowpass', freq=freq_max)
-    else:
-        print('filter type not supported!'); return []
+    is_miss = np.amax(abs(data), axis=1)==0
+    if np.all(is_miss): return []
+    if np.any(is_miss): data[is_miss] = data[np.where(~is_miss)[0][-1]]
+    # fill gap, detrend, taper & filter
+    data = preprocess_lib.preprocess(data, samp_rate, freq_band, max_gap)
+    if data is None: print('filter type not supported!'); return []
+    return preprocess_lib.data2stream(data, stream)
+
+
+class STA_LTA_Kurtosis_RT(STA_LTA_Kurtosis):
+  """ Real-time STA_LTA_Kurtosis for packetized input
+    per station state: short data buffer, running cumsums (STA/LTA & S amp), filter state, 
+      & trigger state (pending triggers & det_gap hold)
+    --> a trigger is picked once all data read by its P & S search has arrived
+    *note: STA/LTA is the boxcar STA/LTA of STA_LTA_Kurtosis (from running cumsums), not a recursive one,
+      as recursive STA/LTA does not reproduce the batch picks
+    *note: the buffer is preallocated & compacted (with cumsums re-based) only when full,
+      so the cost of a packet does not grow with buffer len
+  Inputs
+    same as STA_LTA_Kurtosis (pca_cache & chunk mode not used)
+    data: 3-chn packet (np.array, shape 3 x npts, [e, n, z])
+    *note: with to_prep, only the causal filter of preprocess is applied (state kept across packets)
+    *note: with to_prep=False, picks are nearly the same as STA_LTA_Kurtosis.pick on the whole trace;
+      cumsums are re-based on the buffer & windows sliced from its ends, so rounding may differ slightly
+    *note: a time gap between packets restarts the station
+  Usage
+    import picker_pal
+    picker = picker_pal.STA_LTA_Kurtosis_RT()
+    picks = picker.add_packet(net_sta, data, start_time, samp_rate, out_file, sta_idx)
+    picks = picker.flush(out_file=out_file)
+  """
+  def __init__(self, **kwargs):
+    super(STA_LTA_Kurtosis_RT, self).__init__(**kwargs)
+    self.sta_state = {}
 
+  def add_packet(self, net_sta, data, start_time, samp_rate, out_file=None, sta_idx=-1):
+    picks = []
+    state = self.sta_state.get(net_sta)
+    if state and abs(start_time - (state['start_time'] + state['num_npts']/samp_rate)) > 0.5/samp_rate:
+        print('{}: data gap at {}, restart'.format(net_sta, start_time))
+        picks.append(self.flush(net_sta, out_file))
+        state = None
+    if not state:
+        state = self.init_state(start_time, samp_rate, sta_idx)
+        self.sta_state[net_sta] = state
+    self.update_state(state, data)
+    picks.append(self.pick_state(net_sta, state, out_file))
+    return np.concatenate(picks)
+
+  # pick all pending triggers of a station (all if None) with data received, & drop its state
+  def flush(self, net_sta=None, out_file=None):
+    picks = [np.array([], dtype=self.pick_dtype)]
+    for net_sta in ([net_sta] if net_sta else list(self.sta_state)):
+        state = self.sta_state.pop(net_sta, None)
+        if state: picks.append(self.pick_state(net_sta, state, out_file, to_flush=True))
+    return np.concatenate(picks)
+
+  def init_state(self, start_time, samp_rate, sta_idx):
+    npts = self.get_npts(samp_rate)
+    win_sta_npts, win_lta_npts, p_win_npts, s_win_npts, pca_win_npts, pca_range_npts, win_kurt_npts, amp_win_npts, _ = npts
+    # bounds of data read by eval_trig before & after trig_idx
+    back_npts = p_win_npts[0] + max(win_lta_npts) + 1 \
+        + max(win_kurt_npts[0], win_lta_npts[2], amp_win_npts[0], pca_range_npts[0])
+    ts_npts = max(s_win_npts, pca_range_npts[1]) + pca_range_npts[0] + win_sta_npts[2]
+    ahead_npts = p_win_npts[1] + win_sta_npts[1] + int(1.5*ts_npts) + win_sta_npts[0] + 2 \
+        + max(amp_win_npts[1], 3*pca_win_npts, pca_range_npts[1] + pca_win_npts)
+    state = {'start_time':start_time, 'samp_rate':samp_rate, 'sta_idx':sta_idx, 'npts':npts,
+             'back_npts':back_npts, 'ahead_npts':ahead_npts, 
+             # buffer from buf_idx (index since start_time) to num_npts, at buf_off of the preallocated arrays
+             #   cumsums have a leading value (0 at the last compaction), cf_trig is 0 from cf_idx on
+             'buf_idx':0, 'num_npts':0, 'buf_off':0, 
+             'buf':{'st_data':np.zeros([3,0]), 'eng_h':np.zeros(0), 'eng_z':np.zeros(0), 'cf_trig':np.zeros(0),
+                    'cum_z':np.zeros(1), 'cum_velo':np.zeros([3,1])},
+             # STA/LTA done to cf_idx, triggers not picked, & det_gap hold
+             'cf_idx':0, 'trig_index':[], 'hold_idx':-1, 'is_end':False,
+             'qc_counts':{qc_name: 0 for qc_name in ['p_fd','p_amp','fd','amp_ratio','A12','A13']}}
+    if self.to_prep:
+        state['sos'] = preprocess_lib.get_sos(samp_rate, *self.freq_band)
+        state['zi'] = np.zeros([state['sos'].shape[0], 3, 2])
+    return state
+
+  # views of buffered data (index 0 at buf_idx)
+  def get_buf(self, state):
+    buf, buf_off = state['buf'], state['buf_off']
+    buf_npts = state['num_npts'] - state['buf_idx']
+    buf_view = {key: buf[key][..., buf_off : buf_off+buf_npts] for key in ['st_data','eng_h','eng_z','cf_trig']}
+    for key in ['cum_z','cum_velo']: buf_view[key] = buf[key][..., buf_off : buf_off+buf_npts+1]
+    return buf_view
+
+  # make room for num_new samples: move buffer to the front of larger arrays if full
+  def grow_buf(self, state, num_new):
+    buf, buf_off = state['buf'], state['buf_off']
+    buf_npts = state['num_npts'] - state['buf_idx']
+    buf_len = buf['st_data'].shape[1]
+    if buf_off + buf_npts + num_new <= buf_len: return
+    buf_len = max(buf_len, 2*(buf_npts + num_new))
+    for key, arr in buf.items():
+        num_lead = 1 if key.startswith('cum') else 0
+        new_arr = np.zeros(arr.shape[:-1] + (buf_len + num_lead,))
+        new_arr[..., 0:buf_npts+num_lead] = arr[..., buf_off : buf_off+buf_npts+num_lead]
+        # re-base cumsums, so that they do not grow with stream len
+        if num_lead: new_arr[..., 0:buf_npts+1] -= arr[..., buf_off : buf_off+1]
+        buf[key] = new_arr
+    state['buf_off'] = 0
+
+  # append packet to buffer, & run STA/LTA on new samples
+  def update_state(self, state, data):
+    data = np.array(data, dtype=np.float64)
+    data[np.isnan(data)] = 0
+    data[np.isinf(data)] = 0
+    if self.to_prep: data, state['zi'] = sosfilt(state['sos'], data, axis=-1, zi=state['zi'])
+    eng_h, eng_z, _ = self.calc_trace_cache(data)
+    num_new = data.shape[1]
+    self.grow_buf(state, num_new)
+    buf = state['buf']
+    idx = state['buf_off'] + state['num_npts'] - state['buf_idx']
+    buf['st_data'][:, idx:idx+num_new] = data
+    buf['eng_h'][idx:idx+num_new] = eng_h
+    buf['eng_z'][idx:idx+num_new] = eng_z
+    # continue cumsum from last value
+    buf['cum_z'][idx:idx+num_new+1] = np.cumsum(np.concatenate([buf['cum_z'][idx:idx+1], eng_z]))
+    buf['cum_velo'][:, idx:idx+num_new+1] = np.cumsum(np.concatenate([buf['cum_velo'][:,idx:idx+1], data], axis=1), axis=1)
+    state['num_npts'] += num_new
+    # STA/LTA (same as calc_sta_lta) for idx in [cf_idx, num_npts - win_sta)
+    win_sta_npts, win_lta_npts = state['npts'][0][0], state['npts'][1][0]
+    buf_idx, idx0, idx1 = state['buf_idx'], state['cf_idx'], state['num_npts'] - win_sta_npts
+    if idx1<=idx0: return
+    idx = np.arange(idx0, idx1) - buf_idx
+    buf_view = self.get_buf(state)
+    cum_z = buf_view['cum_z']
+    sta = (cum_z[idx+win_sta_npts+1] - cum_z[idx+1]) / win_sta_npts
+    lta = np.ones(len(idx))
+    to_calc = idx + buf_idx >= win_lta_npts
+    lta[to_calc] = (cum_z[idx[to_calc]+1] - cum_z[idx[to_calc]+1-win_lta_npts]) / win_lta_npts
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cf_trig = sta / lta
+    cf_trig[~to_calc] = 0.
+    cf_trig[np.isinf(cf_trig)] = 0.
+    cf_trig[np.isnan(cf_trig)] = 0.
+    buf_view['cf_trig'][idx0-buf_idx : idx1-buf_idx] = cf_trig
+    state['trig_index'] += list(np.where(cf_trig > self.trig_thres)[0] + idx0)
+    state['cf_idx'] = idx1
+
+  # pick triggers with enough data (or all if to_flush), in time order as pick_seg
+  def pick_state(self, net_sta, state, out_file=None, to_flush=False):
+    picks = []
+    samp_rate, buf_idx = state['samp_rate'], state['buf_idx']
+    trace = self.get_buf(state)
+    trace.update({key: state[key] for key in ['samp_rate','npts']})
+    trace['start_time'] = state['start_time'] + buf_idx/samp_rate
+    trace['end_time'] = state['start_time'] + (state['num_npts']-1)/samp_rate
+    trace['pol'], trace['t_ref'] = None, None
+    det_gap_npts = state['npts'][-1]
+    trig_index = state['trig_index']
+    while len(trig_index)>0 and not state['is_end']:
+        trig_idx = trig_index[0]
+        if trig_idx <= state['hold_idx']: trig_index.pop(0); continue
+        if not to_flush and trig_idx + state['ahead_npts'] > state['num_npts']: break
+        trig_index.pop(0)
+        status, tp_idx, ts_idx, pick = self.eval_trig(trace, trig_idx - buf_idx)
+        if status=='skip': continue
+        if status=='end': state['is_end'] = True; break
+        # output picks
+        if status!='pick': state['qc_counts'][status] += 1
+        else:
+            tp, ts, s_amp, qual_code = pick
+            print('{}, {}, {}'.format(net_sta, tp, ts))
+            sta_ot = self.calc_ot(tp, ts)
+            picks.append((state['sta_idx'], sta_ot.timestamp, tp.timestamp, ts.timestamp, s_amp))
+            if out_file: 
+                out_file.write('{},{},{},{},{},{}\n'.format(net_sta, sta_ot, tp, ts, s_amp, qual_code))
+        # next detected phase
+        if ts_idx is None: ts_idx = tp_idx
+        state['hold_idx'] = max(trig_idx - buf_idx, ts_idx, tp_idx) + det_gap_npts + buf_idx
+    # drop data not needed by pending & new triggers
+    keep_idx = min(trig_index[0], state['cf_idx']) if trig_index else state['cf_idx']
+    num_drop = keep_idx - state['back_npts'] - buf_idx
+    if num_drop>0:
+        state['buf_off'] += num_drop
+        state['buf_idx'] += num_drop
+    return np.array(picks, dtype=self.pick_dtype)
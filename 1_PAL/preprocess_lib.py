@@ -0,0 +1,143 @@
+""" Waveform preprocessing engine, shared by PAL & SAR
+    works on NumPy arrays (num_chn x npts, float32 by default), in-place where possible
+    nan & inf --> fill gap --> demean, detrend & taper --> (resample) --> filter
+    *note: filter runs in place in blocks with filter state carried over (same output as whole trace)
+    *note: with block_len (off by default), resample is polyphase in overlapped blocks; otherwise FFT resample
+      on the whole trace (as obspy)
+    *note: blocks reduce temporary allocations only: the whole trace & its resampled output are still in memory
+      (for bounded memory, pick in chunks, see picker_pal chunk_len)
+  Usage
+    import preprocess_lib
+    data = preprocess_lib.stream2data(stream)
+    data = preprocess_lib.preprocess(data, samp_rate, freq_band)
+    stream = preprocess_lib.data2stream(data, stream)
+"""
+from functools import lru_cache
+from fractions import Fraction
+import numpy as np
+from obspy import Stream, Trace
+from scipy.signal import iirfilter, sosfilt, get_window, resample_poly
+from scipy.signal.windows import hann
+
+# aligned stream --> data array (with nan & inf set to 0)
+def stream2data(stream, dtype=np.float32):
+    npts = min([len(trace.data) for trace in stream])
+    data = np.array([trace.data[0:npts] for trace in stream], dtype=dtype)
+    data[~np.isfinite(data)] = 0
+    return data
+
+# data array --> new stream with headers of stream
+def data2stream(data, stream, samp_rate=None):
+    st = Stream()
+    for ii, trace in enumerate(stream):
+        header = trace.stats.copy()
+        if samp_rate: header.sampling_rate = samp_rate
+        st.append(Trace(data[ii], header=header))
+    return st
+
+def preprocess(data, samp_rate, freq_band, max_gap=5., min_gap_npts=3, taper_len=5., out_rate=None, block_len=None):
+    if max_gap: fill_gap(data, int(max_gap*samp_rate), min_gap_npts)
+    detrend_taper(data, samp_rate, taper_len)
+    if out_rate and out_rate!=samp_rate:
+        if block_len: data = resample_block(data, samp_rate, out_rate, int(block_len*out_rate))
+        else: data = resample(data, samp_rate, out_rate).astype(data.dtype)
+        samp_rate = out_rate
+    return filter_data(data, samp_rate, freq_band)
+
+# fill const segments (>= min_gap_npts) with the data after them, tiled if shorter (in-place)
+def fill_gap(data, max_gap_npts, min_gap_npts=3):
+    npts = data.shape[-1]
+    for chn_data in data.reshape(-1, npts):
+        gap_idx = np.where(np.diff(chn_data)==0)[0]
+        if len(gap_idx)==0: continue
+        # runs of zero diff
+        run_break = np.where(np.diff(gap_idx)!=1)[0] + 1
+        run_start = gap_idx[np.concatenate([[0], run_break])]
+        run_end = gap_idx[np.concatenate([run_break-1, [len(gap_idx)-1]])]
+        is_gap = run_end - run_start + 1 >= min_gap_npts
+        run_start, run_end = run_start[is_gap], run_end[is_gap]
+        # fill [idx0, idx1) with [idx1, idx2)
+        idx0 = np.maximum(0, run_start-1)
+        idx1 = np.minimum(npts-1, run_end+1)
+        idx2 = np.minimum(np.minimum(2*idx1-idx0, idx1+max_gap_npts), np.append(run_start[1:], npts-1))
+        to_fill = idx2 > idx1
+        idx0, idx1, idx2 = idx0[to_fill], idx1[to_fill], idx2[to_fill]
+        if len(idx0)==0: continue
+        fill_npts = idx1 - idx0
+        offset = np.arange(np.sum(fill_npts)) - np.repeat(np.cumsum(fill_npts) - fill_npts, fill_npts)
+        dst_idx = np.repeat(idx0, fill_npts) + offset
+        src_idx = np.repeat(idx1, fill_npts) + offset % np.repeat(idx2-idx1, fill_npts)
+        chn_data[dst_idx] = chn_data[src_idx]
+    return data
+
+# demean, linear detrend & hann taper (as obspy, in-place)
+def detrend_taper(data, samp_rate, taper_len=5., max_percentage=0.05):
+    npts = data.shape[-1]
+    data -= np.mean(data, axis=-1, keepdims=True)
+    if npts>1:
+        t = np.arange(npts) - (npts-1)/2
+        slope = np.dot(data, t) / np.dot(t, t)
+        for chn_data, slope_i in zip(data.reshape(-1, npts), slope.reshape(-1)):
+            chn_data -= slope_i * t
+    # taper both sides
+    win_npts = min(int(max_percentage*npts), int(taper_len*samp_rate), int(npts/2))
+    if win_npts==0: return data
+    taper = hann(2*win_npts) if 2*win_npts==npts else hann(2*win_npts+1)
+    data[..., 0:win_npts] *= taper[0:win_npts]
+    data[..., npts-win_npts:] *= taper[len(taper)-win_npts:]
+    return data
+
+# FFT resample with hann window (as obspy Trace.resample)
+def resample(data, samp_rate, out_rate):
+    npts = data.shape[-1]
+    num = max(1, int(npts / (samp_rate / float(out_rate))))
+    spec = np.fft.rfft(data, axis=-1)
+    spec *= np.fft.ifftshift(get_window('hann', npts))[0:npts//2+1]
+    freq = 1. / (npts / samp_rate) * np.arange(npts//2+1)
+    out_freq = 1. / num * out_rate * np.arange(num//2+1)
+    out_spec = np.zeros(spec.shape[:-1] + (num//2+1,), dtype=spec.dtype)
+    for idx in np.ndindex(spec.shape[:-1]):
+        out_spec[idx] = np.interp(out_freq, freq, spec[idx].real) + 1j*np.interp(out_freq, freq, spec[idx].imag)
+    return np.fft.irfft(out_spec, n=num, axis=-1) * (float(num) / npts)
+
+# polyphase resample (as scipy resample_poly on the whole trace), in overlapped blocks of out_block_npts
+#   temporaries are per block, the output is allocated for the whole trace
+def resample_block(data, samp_rate, out_rate, out_block_npts=360000):
+    ratio = Fraction(out_rate / samp_rate).limit_denominator(1000)
+    up, down = ratio.numerator, ratio.denominator
+    npts = data.shape[-1]
+    out_npts = -(-npts * up // down)
+    out_data = np.zeros(data.shape[:-1] + (out_npts,), dtype=data.dtype)
+    # input block starts at multiple of down; pad covers the half len of resample_poly FIR
+    out_block_npts = max(up, out_block_npts // up * up)
+    in_block_npts = out_block_npts // up * down
+    pad_npts = -(-(10*max(up, down) // up + 1) // down) * down
+    for in_idx0 in range(0, npts, in_block_npts):
+        idx0, idx1 = max(0, in_idx0 - pad_npts), min(npts, in_idx0 + in_block_npts + pad_npts)
+        out_idx0 = in_idx0 // down * up
+        out_idx1 = min(out_npts, out_idx0 + out_block_npts)
+        block = resample_poly(data[..., idx0:idx1], up, down, axis=-1)
+        skip_npts = (in_idx0 - idx0) // down * up
+        out_data[..., out_idx0:out_idx1] = block[..., skip_npts : skip_npts + out_idx1 - out_idx0]
+    return out_data
+
+# butterworth sos of obspy filter (4 corners), cached per samp_rate & band
+@lru_cache(maxsize=None)
+def get_sos(samp_rate, freq_min, freq_max, corners=4):
+    fe = 0.5 * samp_rate
+    if freq_min and freq_max and freq_max/fe - 1. <= -1e-6:
+        return iirfilter(corners, [freq_min/fe, freq_max/fe], btype='band', ftype='butter', output='sos')
+    elif freq_min:
+        return iirfilter(corners, freq_min/fe, btype='highpass', ftype='butter', output='sos')
+    elif freq_max:
+        return iirfilter(corners, freq_max/fe, btype='lowpass', ftype='butter', output='sos')
+    return None
+
+# causal filter (in-place) in blocks with filter state, None if filter type not supported
+def filter_data(data, samp_rate, freq_band, block_npts=360000):
+    sos = get_sos(samp_rate, *freq_band)
+    if sos is None: return None
+    zi = np.zeros((sos.shape[0],) + data.shape[:-1] + (2,))
+    for idx0 in range(0, data.shape[-1], block_npts):
+        data[..., idx0:idx0+block_npts], zi = sosfilt(sos, data[..., idx0:idx0+block_npts], axis=-1, zi=zi)
+    return data
@@ -28,8 +28,7 @@ if __name__ == '__main__':
 cfg = config.Config()
 get_picks = cfg.get_picks
 sta_dict = cfg.get_sta_dict(args.sta_file)
-associator = associator_pal.PS_Pair_Assoc(\
-    sta_dict,
+assoc_params = dict(\
     xy_margin = cfg.xy_margin,
     xy_grid = cfg.xy_grid,
     z_grids = cfg.z_grids,
@@ -37,7 +36,14 @@ associator = associator_pal.PS_Pair_Assoc(\
     ot_dev = cfg.ot_dev,
     max_res = cfg.max_res,
     max_drop = cfg.max_drop,
-    vp = cfg.vp)
+    vp = cfg.vp,
+    xy_coarse = cfg.xy_coarse,
+    tt_mode = cfg.tt_mode,
+    tt_dd_grid = cfg.tt_dd_grid,
+    tt_dir = cfg.tt_dir)
+if cfg.tile_size: 
+    associator = associator_pal.Tiled_Assoc(sta_dict, cfg.tile_size, cfg.tile_margin, cfg.tile_workers, **assoc_params)
+else: associator = associator_pal.PS_Pair_Assoc(sta_dict, **assoc_params)
 
 # i/o paths
 out_root = os.path.split(args.out_ctlg)[0]
@@ -55,9 +61,11 @@ num_day = (end_date.date - start_date.date).days
 for day_idx in range(num_day):
     # 1. get picks
     date = start_date + day_idx*86400
-    picks = get_picks(date, args.pick_dir)
-    picks = picks[[net_sta in sta_dict for net_sta in picks['net_sta']]]
+    picks = get_picks(date, args.pick_dir, sta_dict)
     # 2. associate picks: picks --> events
-    associator.associate(picks, out_ctlg, out_pha)
+    if cfg.stream_assoc: associator.add_picks(picks, (date+86400).timestamp-cfg.max_ttp, out_ctlg, out_pha)
+    else: associator.associate(picks, out_ctlg, out_pha)
+if cfg.stream_assoc: associator.flush(out_ctlg, out_pha)
+associator.close()
 out_pha.close()
 out_ctlg.close()
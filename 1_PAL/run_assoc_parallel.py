@@ -0,0 +1,112 @@
+""" Run associator in parallel
+    picks --> time partitions (with overlap) --> events --> merged catalog
+"""
+import os
+import argparse
+import multiprocessing as mp
+import numpy as np
+from obspy import UTCDateTime
+import associator_pal
+import config
+import warnings
+warnings.filterwarnings("ignore")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pick_dir', type=str,
+                        default='output/eg/picks')
+    parser.add_argument('--time_range', type=str,
+                        default='20171003-20171004')
+    parser.add_argument('--sta_file', type=str,
+                        default='input/example_pal_format1.sta')
+    parser.add_argument('--out_ctlg', type=str,
+                        default='output/eg/catalog.dat')
+    parser.add_argument('--out_pha', type=str,
+                        default='output/eg/phase.dat')
+    parser.add_argument('--num_workers', type=int, default=3)
+    args = parser.parse_args()
+
+# PAL config
+cfg = config.Config()
+
+def get_associator(sta_dict, tile_workers=cfg.tile_workers, tt_dir=cfg.tt_dir):
+    assoc_params = dict(\
+        xy_margin = cfg.xy_margin,
+        xy_grid = cfg.xy_grid,
+        z_grids = cfg.z_grids,
+        min_sta = cfg.min_sta,
+        ot_dev = cfg.ot_dev,
+        max_res = cfg.max_res,
+        max_drop = cfg.max_drop,
+        vp = cfg.vp,
+        xy_coarse = cfg.xy_coarse,
+        tt_mode = cfg.tt_mode,
+        tt_dd_grid = cfg.tt_dd_grid,
+        tt_dir = tt_dir)
+    if cfg.tile_size: 
+        return associator_pal.Tiled_Assoc(sta_dict, cfg.tile_size, cfg.tile_margin, tile_workers, **assoc_params)
+    return associator_pal.PS_Pair_Assoc(sta_dict, **assoc_params)
+
+def init_worker(sta_file, pick_dir, tt_dir):
+    global sta_dict, associator, worker_pick_dir
+    sta_dict = cfg.get_sta_dict(sta_file)
+    associator = get_associator(sta_dict, tile_workers=1, tt_dir=tt_dir)
+    worker_pick_dir = pick_dir
+
+# read picks with sta_ot in [t0, t1)
+def read_picks(t0, t1, pick_dir, sta_dict):
+    # picks of a day may have sta_ot in the day before
+    date0 = UTCDateTime(UTCDateTime(t0).date)
+    num_days = (UTCDateTime(t1 + cfg.max_ttp).date - date0.date).days + 1
+    picks = []
+    for day_idx in range(num_days):
+        picks.append(cfg.get_picks(date0 + day_idx*86400, pick_dir, sta_dict))
+    picks = np.concatenate(picks)
+    return picks[(picks['sta_ot']>=t0) * (picks['sta_ot']<t1)]
+
+# assoc one partition: events with ot in [t0, t1), using picks in [t0-overlap, t1+overlap)
+def assoc_part(part):
+    part_idx, t0, t1 = part
+    picks = read_picks(t0 - cfg.assoc_overlap, t1 + cfg.assoc_overlap, worker_pick_dir, sta_dict)
+    print('assoc partition {}: {} to {}, {} picks'.format(part_idx, UTCDateTime(t0), UTCDateTime(t1), len(picks)))
+    if len(picks)==0: return []
+    events_loc, events_pick = associator.associate(picks)
+    return [(part_idx, event_loc, event_pick) for event_loc, event_pick in zip(events_loc, events_pick) \
+        if t0 <= event_loc['evt_ot'] < t1]
+
+
+if __name__ == '__main__':
+    # i/o paths
+    out_root = os.path.split(args.out_ctlg)[0]
+    if not os.path.exists(out_root): os.makedirs(out_root)
+    # make (or load) time table before the workers, on disk so that workers share it
+    tt_dir = cfg.tt_dir if cfg.tt_dir or args.num_workers<=1 else os.path.join(out_root, 'tt_table')
+    sta_dict = cfg.get_sta_dict(args.sta_file)
+    associator = get_associator(sta_dict, tt_dir=tt_dir)
+    # divide by day
+    start_date, end_date = [UTCDateTime(date) for date in args.time_range.split('-')]
+    print('run parallel assoc: picks --> events')
+    print('time range: {} to {}'.format(start_date.date, end_date.date))
+    num_days = (end_date.date - start_date.date).days
+    parts = [(day_idx, (start_date + day_idx*86400).timestamp, (start_date + (day_idx+1)*86400).timestamp) \
+        for day_idx in range(num_days)]
+    pool = mp.Pool(args.num_workers, initializer=init_worker, initargs=(args.sta_file, args.pick_dir, tt_dir))
+    events = sum(pool.map(assoc_part, parts, chunksize=1), [])
+    pool.close(); pool.join()
+    # merge & re-assoc the picks left by events dropped at seams
+    events_merged = associator_pal.merge_events(events)
+    picks_left = associator_pal.get_left_picks(events, events_merged)
+    num_left = 0 if picks_left is None else len(picks_left)
+    if num_left>0:
+        events_loc, events_pick = associator.associate(picks_left)
+        events_merged = sorted(events_merged + list(zip(events_loc, events_pick)), key=lambda evt: evt[0]['evt_ot'])
+    events = events_merged
+    print('{} events after merging {} partitions ({} seam picks re-associated)'.format(len(events), len(parts), num_left))
+    out_ctlg = open(args.out_ctlg,'w')
+    out_pha = open(args.out_pha,'w')
+    for event_loc, event_pick in events:
+        associator.write_catalog(event_loc, out_ctlg)
+        associator.write_phase(event_loc, event_pick, out_pha)
+    associator.close()
+    out_pha.close()
+    out_ctlg.close()
@@ -15,12 +15,19 @@ class Config(object):
     self.s_win      = 10.            # search win for S 
     self.pca_win    = 1.             # win_len for PCA filter
     self.pca_range  = [0.,2.]        # time range to apply PCA filter
+    self.pca_cache  = False          # whether to precompute PCA pol for whole trace
     self.fd_thres   = 2.5            # min value of dominant frequency
     self.amp_ratio_thres = [5,8,3]   # max amp ratio for Peak, P/P_tail, & P/S
     self.amp_win    = [1.,5.]        # time win to get S amplitude
     self.det_gap    = 5.             # time gap between detections
     self.to_prep    = True           # whether to preprocess the raw data
     self.freq_band  = [1,20]         # frequency band 
+    self.trig_workers = 1            # num of threads to eval triggers (1 for serial); keep 1 unless per-trigger numpy work
+                                     #   is large enough to release the GIL (often slower, see benchmark.py --target=workers);
+                                     #   to use more cores, pick stations in parallel (run_pick_assoc --num_workers)
+    self.early_reject = False        # run P-side QC before S picking
+    self.chunk_len  = None           # chunk len for bounded-memory picking (None for whole trace)
+    self.chunk_pad  = 60.            # data padded on both sides of a chunk
     # 2. assoc params
     self.min_sta    = 4                  # min num of stations to assoc
     self.ot_dev     = 2.                 # max time deviation for ot assoc
@@ -28,9 +35,19 @@ class Config(object):
     self.max_drop   = 1                  # max num of drop of each pick
     self.xy_margin  = 0.1                # ratio of lateral margin, relative to sta range
     self.xy_grid    = 0.02               # lateral grid width, in degree
+    self.xy_coarse  = 1                  # coarse grid factor for loc search (1 for full grid)
     self.z_grids    = np.arange(2,20,3)  # z (dep) grids
     self.vp         = 5.9                # averaged P velocity
     self.vs         = 3.45               # averaged S velocity
+    self.tt_mode    = 'grid'             # 'grid': time table per sta; 'dist': shared distance-depth table
+    self.tt_dd_grid = 0.5                # grid width of distance-depth table, in km
+    self.tt_dir     = None               # dir to cache time tables on disk (memory-mapped), e.g. 'output/tt_table'; None to keep in RAM (run_assoc_parallel then uses tt_table in the output dir)
+    self.stream_assoc = False          # assoc across days with a rolling pick buffer
+    self.max_ttp    = 30.                # max tp - sta_ot of picks (sec), for stream assoc
+    self.assoc_overlap = 60.             # overlap of time partitions in parallel assoc (sec)
+    self.tile_size  = None               # lateral size of assoc tiles, in degree (None for one grid)
+    self.tile_margin = 0.5               # sta margin around each tile, in degree
+    self.tile_workers = 1                # num of processes to assoc tiles
     # 3. data pipeline
     self.get_data_dict = dp.get_data_dict
     self.get_sta_dict = dp.get_sta_dict
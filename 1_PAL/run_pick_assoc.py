@@ -1,8 +1,11 @@
 """ Run picker and associator
     raw waveforms --> picks --> events
+    *note: assoc of day d runs in a thread while day d+1 is picked (at most queue_size days queued)
 """
-import os, glob
+import os, io, glob
 import argparse
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from obspy import UTCDateTime
 import picker_pal
@@ -25,71 +28,126 @@ if __name__ == '__main__':
                         default='output/eg/phase.dat')
     parser.add_argument('--out_pick_dir', type=str,
                         default='output/eg/picks')
+    parser.add_argument('--num_workers', type=int, default=1)
+    parser.add_argument('--queue_size', type=int, default=1)
     args = parser.parse_args()
 
 # PAL config
 cfg = config.Config()
-get_data_dict = cfg.get_data_dict
-read_data = cfg.read_data
-sta_dict = cfg.get_sta_dict(args.sta_file)
-picker = picker_pal.STA_LTA_Kurtosis(\
-    win_sta = cfg.win_sta,
-    win_lta = cfg.win_lta,
-    trig_thres = cfg.trig_thres,
-    p_win = cfg.p_win,
-    s_win = cfg.s_win,
-    pca_win = cfg.pca_win, 
-    pca_range = cfg.pca_range,
-    fd_thres = cfg.fd_thres,
-    amp_ratio_thres = cfg.amp_ratio_thres,
-    amp_win = cfg.amp_win,
-    win_kurt = cfg.win_kurt,
-    det_gap = cfg.det_gap,
-    to_prep = cfg.to_prep,
-    freq_band = cfg.freq_band,
-    vp = cfg.vp,
-    vs = cfg.vs)
-associator = associator_pal.PS_Pair_Assoc(\
-    sta_dict,
-    xy_margin = cfg.xy_margin,
-    xy_grid = cfg.xy_grid, 
-    z_grids = cfg.z_grids,
-    min_sta = cfg.min_sta,
-    ot_dev = cfg.ot_dev,
-    max_res = cfg.max_res,
-    max_drop = cfg.max_drop, 
-    vp = cfg.vp)
 
-# i/o paths
-out_root = os.path.split(args.out_ctlg)[0]
-if not os.path.exists(out_root): os.makedirs(out_root)
-if not os.path.exists(args.out_pick_dir): os.makedirs(args.out_pick_dir)
-out_ctlg = open(args.out_ctlg,'w')
-out_pha = open(args.out_pha,'w')
+def get_picker():
+    return picker_pal.STA_LTA_Kurtosis(\
+        win_sta = cfg.win_sta,
+        win_lta = cfg.win_lta,
+        trig_thres = cfg.trig_thres,
+        p_win = cfg.p_win,
+        s_win = cfg.s_win,
+        pca_win = cfg.pca_win, 
+        pca_range = cfg.pca_range,
+        pca_cache = cfg.pca_cache,
+        fd_thres = cfg.fd_thres,
+        amp_ratio_thres = cfg.amp_ratio_thres,
+        amp_win = cfg.amp_win,
+        win_kurt = cfg.win_kurt,
+        det_gap = cfg.det_gap,
+        to_prep = cfg.to_prep,
+        freq_band = cfg.freq_band,
+        vp = cfg.vp,
+        vs = cfg.vs,
+        num_workers = cfg.trig_workers,
+        early_reject = cfg.early_reject,
+        chunk_len = cfg.chunk_len,
+        chunk_pad = cfg.chunk_pad)
 
-# get time range
-start_date, end_date = [UTCDateTime(date) for date in args.time_range.split('-')]
-print('run pick & assoc: raw_waveform --> picks --> events')
-print('time range: {} to {}'.format(start_date.date, end_date.date))
-# for all days
-num_days = (end_date.date - start_date.date).days
-for day_idx in range(num_days):
-    # get data paths
-    date = start_date + day_idx*86400
-    data_dict = get_data_dict(date, args.data_dir)
-    todel = [net_sta for net_sta in data_dict if net_sta not in sta_dict]
-    for net_sta in todel: data_dict.pop(net_sta)
-    if data_dict=={}: continue
-    # 1. phase picking: waveform --> picks
-    fpick_path = os.path.join(args.out_pick_dir, '%s.pick'%date.date)
-    out_pick = open(fpick_path,'w')
-    for i, st_paths in enumerate(data_dict.values()):
-        print('-'*40)
-        stream = read_data(st_paths, sta_dict)
-        picks_i = picker.pick(stream, out_pick)
-        picks = picks_i if i==0 else np.append(picks, picks_i)
-    out_pick.close()
-    # 2. associate picks: picks --> events
-    associator.associate(picks, out_ctlg, out_pha)
-out_pha.close()
-out_ctlg.close()
+def get_associator(sta_dict):
+    assoc_params = dict(\
+        xy_margin = cfg.xy_margin,
+        xy_grid = cfg.xy_grid, 
+        z_grids = cfg.z_grids,
+        min_sta = cfg.min_sta,
+        ot_dev = cfg.ot_dev,
+        max_res = cfg.max_res,
+        max_drop = cfg.max_drop, 
+        vp = cfg.vp,
+        xy_coarse = cfg.xy_coarse,
+        tt_mode = cfg.tt_mode,
+        tt_dd_grid = cfg.tt_dd_grid,
+        tt_dir = cfg.tt_dir)
+    if cfg.tile_size: 
+        return associator_pal.Tiled_Assoc(sta_dict, cfg.tile_size, cfg.tile_margin, cfg.tile_workers, **assoc_params)
+    return associator_pal.PS_Pair_Assoc(sta_dict, **assoc_params)
+
+# picker & sta of each pick process (set in the worker, so that any mp start method works)
+def init_worker(sta_file):
+    global picker, sta_dict, sta_idx_dict
+    sta_dict = cfg.get_sta_dict(sta_file)
+    sta_idx_dict = {net_sta: ii for ii, net_sta in enumerate(sta_dict)}
+    picker = get_picker()
+
+# pick one station: waveform --> picks & lines of pick file
+def pick_sta(sta_item):
+    net_sta, st_paths = sta_item
+    print('-'*40)
+    out_pick = io.StringIO()
+    if cfg.chunk_len:
+        # read headers, then data chunk by chunk
+        stream = cfg.read_data(st_paths, sta_dict, headonly=True)
+        read_chunk = lambda t0, t1: cfg.read_data(st_paths, sta_dict, t0, t1)
+        picks = picker.pick(stream, out_pick, sta_idx_dict[net_sta], read_chunk)
+    else:
+        stream = cfg.read_data(st_paths, sta_dict)
+        picks = picker.pick(stream, out_pick, sta_idx_dict[net_sta])
+    return picks, out_pick.getvalue()
+
+# assoc one day: picks --> events
+def assoc_day(associator, date, picks, out_ctlg, out_pha):
+    if cfg.stream_assoc: associator.add_picks(picks, (date+86400).timestamp-cfg.max_ttp, out_ctlg, out_pha)
+    else: associator.associate(picks, out_ctlg, out_pha)
+
+
+if __name__ == '__main__':
+    init_worker(args.sta_file)
+    associator = get_associator(sta_dict)
+    # i/o paths
+    out_root = os.path.split(args.out_ctlg)[0]
+    if not os.path.exists(out_root): os.makedirs(out_root)
+    if not os.path.exists(args.out_pick_dir): os.makedirs(args.out_pick_dir)
+    out_ctlg = open(args.out_ctlg,'w')
+    out_pha = open(args.out_pha,'w')
+    # get time range
+    start_date, end_date = [UTCDateTime(date) for date in args.time_range.split('-')]
+    print('run pick & assoc: raw_waveform --> picks --> events')
+    print('time range: {} to {}'.format(start_date.date, end_date.date))
+    # for all days
+    num_days = (end_date.date - start_date.date).days
+    pool = mp.Pool(args.num_workers, initializer=init_worker, initargs=(args.sta_file,)) if args.num_workers>1 else None
+    assoc_executor = ThreadPoolExecutor(1)
+    assoc_queue = []
+    for day_idx in range(num_days):
+        # get data paths
+        date = start_date + day_idx*86400
+        data_dict = cfg.get_data_dict(date, args.data_dir)
+        todel = [net_sta for net_sta in data_dict if net_sta not in sta_dict]
+        for net_sta in todel: data_dict.pop(net_sta)
+        if data_dict=={}: continue
+        # 1. phase picking: waveform --> picks
+        fpick_path = os.path.join(args.out_pick_dir, '%s.pick'%date.date)
+        fpick = open(fpick_path,'w')
+        # pick stations in parallel, write in station order
+        pick_map = pool.imap(pick_sta, data_dict.items()) if pool else map(pick_sta, data_dict.items())
+        picks = []
+        for picks_i, pick_lines in pick_map:
+            fpick.write(pick_lines)
+            picks.append(picks_i)
+        picks = np.concatenate(picks)
+        fpick.close()
+        # 2. associate picks: picks --> events (in time order, overlapped with picking of next day)
+        while len(assoc_queue) >= args.queue_size: assoc_queue.pop(0).result()
+        assoc_queue.append(assoc_executor.submit(assoc_day, associator, date, picks, out_ctlg, out_pha))
+    for assoc_job in assoc_queue: assoc_job.result()
+    assoc_executor.shutdown()
+    if cfg.stream_assoc: associator.flush(out_ctlg, out_pha)
+    associator.close()
+    if pool: pool.close(); pool.join()
+    out_pha.close()
+    out_ctlg.close()
@@ -0,0 +1,84 @@
+""" Run real-time picker on replayed data
+    raw waveforms --> packets --> picks
+"""
+import os
+import argparse
+import numpy as np
+from obspy import UTCDateTime
+import picker_pal
+import config
+import warnings
+warnings.filterwarnings("ignore")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_dir', type=str,
+                        default='/data/Example_data')
+    parser.add_argument('--time_range', type=str,
+                        default='20190704-20190707')
+    parser.add_argument('--sta_file', type=str,
+                        default='input/example_pal_format1.sta')
+    parser.add_argument('--out_pick_dir', type=str,
+                        default='output/eg/picks_rt')
+    parser.add_argument('--packet_len', type=float, default=1.)
+    args = parser.parse_args()
+
+# PAL config
+cfg = config.Config()
+get_data_dict = cfg.get_data_dict
+read_data = cfg.read_data
+sta_dict = cfg.get_sta_dict(args.sta_file)
+sta_idx_dict = {net_sta: ii for ii, net_sta in enumerate(sta_dict)}
+picker = picker_pal.STA_LTA_Kurtosis_RT(\
+    win_sta = cfg.win_sta,
+    win_lta = cfg.win_lta,
+    trig_thres = cfg.trig_thres,
+    p_win = cfg.p_win,
+    s_win = cfg.s_win,
+    pca_win = cfg.pca_win,
+    pca_range = cfg.pca_range,
+    fd_thres = cfg.fd_thres,
+    amp_ratio_thres = cfg.amp_ratio_thres,
+    amp_win = cfg.amp_win,
+    win_kurt = cfg.win_kurt,
+    det_gap = cfg.det_gap,
+    to_prep = cfg.to_prep,
+    freq_band = cfg.freq_band,
+    vp = cfg.vp,
+    vs = cfg.vs,
+    early_reject = cfg.early_reject)
+
+# i/o paths
+if not os.path.exists(args.out_pick_dir): os.makedirs(args.out_pick_dir)
+
+# get time range
+start_date, end_date = [UTCDateTime(date) for date in args.time_range.split('-')]
+print('run real-time pick: raw_waveform --> packets --> picks')
+print('time range: {} to {}'.format(start_date.date, end_date.date))
+# for all days, replay station data in packets
+num_days = (end_date.date - start_date.date).days
+for day_idx in range(num_days):
+    date = start_date + day_idx*86400
+    data_dict = get_data_dict(date, args.data_dir)
+    fpick_path = os.path.join(args.out_pick_dir, '%s.pick'%date.date)
+    out_pick = open(fpick_path,'w')
+    for net_sta, st_paths in data_dict.items():
+        if net_sta not in sta_dict: continue
+        stream = read_data(st_paths, sta_dict)
+        if len(stream)!=3: continue
+        print('-'*40)
+        # align chn
+        start_time = max([trace.stats.starttime for trace in stream])
+        end_time = min([trace.stats.endtime for trace in stream])
+        if start_time > end_time: continue
+        stream = stream.slice(start_time, end_time, nearest_sample=True)
+        min_npts = min([len(trace) for trace in stream])
+        st_data = np.array([trace.data[0:min_npts] for trace in stream])
+        start_time, samp_rate = stream[0].stats.starttime, stream[0].stats.sampling_rate
+        packet_npts = max(1, int(args.packet_len * samp_rate))
+        for idx in range(0, min_npts, packet_npts):
+            picker.add_packet(net_sta, st_data[:, idx:idx+packet_npts], start_time + idx/samp_rate, \
+                samp_rate, out_pick, sta_idx_dict[net_sta])
+        # pick the remaining triggers at the end of the day stream, so that picks go to the file of their day
+        picker.flush(net_sta, out_pick)
+    out_pick.close()
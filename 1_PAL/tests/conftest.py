@@ -0,0 +1,41 @@
+""" Shared test helpers (also used by benchmark.py): cheap ot-only associator & synthetic stream
+"""
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy as np
+from obspy import Stream, Trace, UTCDateTime
+import associator_pal
+
+class OT_Assoc(associator_pal.PS_Pair_Assoc):
+  """ PS_Pair_Assoc with a cheap loc assoc (the first pick of each sta), to test & time ot clustering only
+  """
+  def calc_tt(self):
+    return {}
+
+  def assoc_loc(self, picks):
+    sta_idx, assoc_idx = np.unique(picks['sta_idx'], return_index=True)
+    if len(sta_idx) < self.min_sta: return [],[],[],list(range(len(picks)))
+    drop_idx = sorted(set(range(len(picks))) - set(assoc_idx))
+    event_loc = {'evt_ot' : picks['sta_ot'][len(picks)//2],
+                 'evt_lon': 0., 'evt_lat': 0., 'evt_dep': 0., 'res': 0.}
+    return event_loc, list(picks[assoc_idx]), list(assoc_idx), drop_idx
+
+  def calc_mag(self, event_pick, event_loc):
+    event_loc['mag'] = -1
+    return event_loc
+
+# synthetic 3-chn stream with P & S arrivals of num_evt events
+def make_stream(rng, trace_len=1800., samp_rate=100., num_evt=30):
+    npts = int(trace_len * samp_rate)
+    t = np.arange(npts) / samp_rate
+    data = rng.normal(0, 1e-8, (3, npts))
+    for tp in rng.uniform(30, trace_len-60, num_evt):
+        ts, amp = tp + rng.uniform(2, 8), 10**rng.uniform(-7, -5)
+        for chn_idx in range(3):
+            w_p, w_s = (0.3, 1.) if chn_idx<2 else (1., 0.3)
+            idx0, idx1 = int(tp*samp_rate), int((tp+6)*samp_rate)
+            data[chn_idx, idx0:idx1] += w_p*amp*np.exp(-(t[idx0:idx1]-tp)/1.5) * np.sin(2*np.pi*8*(t[idx0:idx1]-tp)+chn_idx)
+            idx0, idx1 = int(ts*samp_rate), int((ts+8)*samp_rate)
+            data[chn_idx, idx0:idx1] += 2*w_s*amp*np.exp(-(t[idx0:idx1]-ts)/2.) * np.sin(2*np.pi*5*(t[idx0:idx1]-ts)+2*chn_idx)
+    header = {'network':'XX', 'station':'AA', 'sampling_rate':samp_rate, 'starttime':UTCDateTime(2019,7,4)}
+    return Stream([Trace(data[ii], header=dict(header, channel='HH'+chn)) for ii, chn in enumerate('ENZ')])
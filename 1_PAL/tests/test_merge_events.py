@@ -0,0 +1,55 @@
+""" Merging events of overlapping parts (time partitions or tiles)
+"""
+import numpy as np
+from obspy import UTCDateTime
+import picker_pal
+import associator_pal
+import data_pipeline
+
+dtype = picker_pal.STA_LTA_Kurtosis.pick_dtype
+
+def make_event(part_idx, ot, sta_idx, res=0.1):
+    picks = np.zeros(len(sta_idx), dtype=dtype)
+    picks['sta_idx'] = sta_idx
+    picks['sta_ot'] = ot
+    picks['tp'], picks['ts'] = ot + np.arange(len(sta_idx)), ot + 2*np.arange(len(sta_idx)) + 1
+    event_loc = {'evt_ot': ot, 'evt_lon': 0., 'evt_lat': 0., 'evt_dep': 0., 'res': res}
+    return (part_idx, event_loc, list(picks))
+
+def test_left_picks_of_dropped_event():
+    # the same event seen by two parts: part 1 has two more picks of its own
+    event0 = make_event(0, 100., [0,1,2,3,4])
+    event1 = make_event(1, 100., [0,1,2,3,4,5,6])
+    event1[2][0]['tp'] += 0.5
+    event1[2][1]['tp'] += 0.5
+    events_merged = associator_pal.merge_events([event0, event1])
+    assert len(events_merged) == 1 and len(events_merged[0][1]) == 7
+    assert associator_pal.get_left_picks([event0, event1], events_merged)['sta_idx'].tolist() == [0,1]
+    # no left picks if nothing is dropped
+    assert associator_pal.get_left_picks([event1], associator_pal.merge_events([event1])) is None
+
+def test_missing_pick_file(tmp_path):
+    sta_dict = {'XX.S0': [30., 100., 0., 1.]}
+    for get_picks in [data_pipeline.get_picks, data_pipeline.get_pal_picks]:
+        picks = get_picks(UTCDateTime(2019,7,4), str(tmp_path), sta_dict)
+        assert len(picks) == 0 and picks.dtype.names[0] == 'sta_idx'
+
+def test_tiled_dedup_disjoint_picks():
+    # one event seen by two tiles with disjoint sta, & a distinct event at the same time far away
+    sta_dict = {'XX.S%s'%ii: [30+0.1*ii, 100+0.1*ii, 0., 1.] for ii in range(12)}
+    associator = associator_pal.Tiled_Assoc(sta_dict, tile_size=0.6, tile_margin=0.2, xy_grid=0.1, min_sta=4)
+    events = [make_event(0, 100., [0,1,2,3,4]), make_event(1, 100.5, [6,7,8,9]), make_event(1, 100.2, [10,11,5,4])]
+    events[0][1].update({'evt_lon': 100.3, 'evt_lat': 30.3})
+    events[1][1].update({'evt_lon': 100.35, 'evt_lat': 30.35})
+    events[2][1].update({'evt_lon': 101.1, 'evt_lat': 31.1})
+    events[2][2][3]['tp'] += 0.5
+    events_merged = associator.dedup_events(associator_pal.merge_events(events))
+    assert [len(event_pick) for _, event_pick in events_merged] == [5, 4]
+
+def test_tiled_pool_closed():
+    sta_dict = {'XX.S%s'%ii: [30+0.1*ii, 100+0.1*ii, 0., 1.] for ii in range(12)}
+    associator = associator_pal.Tiled_Assoc(sta_dict, tile_size=0.6, tile_margin=0.2, num_workers=2, xy_grid=0.1, min_sta=4)
+    workers = associator.pool._pool
+    associator.close()
+    assert associator.pool is None and not any(worker.is_alive() for worker in workers)
+    associator.close()
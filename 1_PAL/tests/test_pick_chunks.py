@@ -0,0 +1,38 @@
+""" Chunked picking: same picks as picking the whole trace
+"""
+import io, contextlib
+import numpy as np
+from obspy import UTCDateTime
+import picker_pal
+from conftest import make_stream
+
+def test_slice_snaps_as_whole_trace():
+    # half-sample ties round the same way in a chunk as on the whole trace
+    picker = picker_pal.STA_LTA_Kurtosis()
+    samp_rate, ref_start = 100., UTCDateTime(2019,7,4)
+    ref_end = ref_start + (8640000-1)/samp_rate
+    st_data = np.arange(8640000, dtype=np.float64).reshape(1,-1)
+    rng = np.random.default_rng(0)
+    for _ in range(1000):
+        idx, shift = int(rng.integers(1000, 8630000)), int(rng.integers(0, 1000))
+        t0, t1 = ref_start + (idx+0.5)/samp_rate, ref_start + (idx+500.5)/samp_rate
+        chunk_start = ref_start + (idx-shift)/samp_rate
+        chunk = st_data[:, idx-shift : idx+2000]
+        chunk_end = chunk_start + (chunk.shape[1]-1)/samp_rate
+        data = picker.slice_data(st_data, ref_start, ref_end, samp_rate, t0, t1)
+        data_chunk = picker.slice_data(chunk, chunk_start, chunk_end, samp_rate, t0, t1, [ref_start, ref_end])
+        assert np.array_equal(data, data_chunk)
+
+def test_chunks_same_as_whole_trace():
+    rng = np.random.default_rng(2)
+    stream = picker_pal.STA_LTA_Kurtosis().preprocess(make_stream(rng, trace_len=7200., num_evt=200), [1., 40.])
+    with contextlib.redirect_stdout(io.StringIO()):
+        picker = picker_pal.STA_LTA_Kurtosis(trig_thres=4., to_prep=False)
+        picks = picker.pick(stream.copy())
+        qc_counts = picker.qc_counts
+        for chunk_len in [600., 300.]:
+            picker = picker_pal.STA_LTA_Kurtosis(trig_thres=4., to_prep=False, chunk_len=chunk_len)
+            picks_chunk = picker.pick(stream.copy())
+            assert picker.qc_counts == qc_counts
+            assert np.array_equal(picks_chunk[['sta_idx','sta_ot','tp','ts']], picks[['sta_idx','sta_ot','tp','ts']])
+            assert np.allclose(picks_chunk['s_amp'], picks['s_amp'], rtol=1e-9)
@@ -0,0 +1,52 @@
+""" Real-time picker: packetized picks match batch picks on the whole trace
+"""
+import io, contextlib
+import numpy as np
+import picker_pal
+from conftest import make_stream
+
+# replay stream in packets of random len
+def pick_rt(picker, stream, rng, max_len=500):
+    data = np.array([trace.data for trace in stream])
+    samp_rate, start_time = stream[0].stats.sampling_rate, stream[0].stats.starttime
+    picks, buf_lens, cum_z, idx = [], [], [], 0
+    while idx < data.shape[1]:
+        num_npts = int(rng.integers(1, max_len))
+        picks.append(picker.add_packet('XX.AA', data[:, idx:idx+num_npts], start_time+idx/samp_rate, samp_rate))
+        idx = min(idx + num_npts, data.shape[1])
+        state = picker.sta_state['XX.AA']
+        buf_lens.append(state['buf']['st_data'].shape[1])
+        cum_z.append((idx, picker.get_buf(state)['cum_z'][-1]))
+    picks.append(picker.flush())
+    return np.concatenate(picks), buf_lens, np.array(cum_z)
+
+def check_picks(picks, picks_rt, tol):
+    assert len(picks) > 10
+    assert len(picks_rt) == len(picks)
+    assert np.amax(abs(picks_rt['tp'] - picks['tp'])) <= tol
+    assert np.amax(abs(picks_rt['ts'] - picks['ts'])) <= tol
+    assert np.allclose(picks_rt['s_amp'], picks['s_amp'], rtol=1e-3)
+
+def test_rt_same_as_batch():
+    rng = np.random.default_rng(0)
+    stream = picker_pal.STA_LTA_Kurtosis().preprocess(make_stream(rng), [1., 40.])
+    with contextlib.redirect_stdout(io.StringIO()):
+        picks = picker_pal.STA_LTA_Kurtosis(to_prep=False).pick(stream.copy())
+        picks_rt, buf_lens, cum_z = pick_rt(picker_pal.STA_LTA_Kurtosis_RT(to_prep=False), stream, rng)
+    check_picks(picks, picks_rt, 0.5/stream[0].stats.sampling_rate)
+    # buffer stays bounded, & cumsums are re-based on it (not summed over the whole stream)
+    buf_len = max(buf_lens)
+    assert buf_len < stream[0].stats.npts / 4
+    eng_z = picker_pal.STA_LTA_Kurtosis().calc_trace_cache(np.array([trace.data for trace in stream], dtype=np.float64))[1]
+    cum_all = np.concatenate([[0], np.cumsum(eng_z)])
+    idx = cum_z[:,0].astype(int)
+    assert np.all(cum_z[:,1] <= cum_all[idx] - cum_all[np.maximum(0, idx-buf_len)] + 1e-9*cum_all[-1])
+
+def test_rt_causal_filter_close_to_batch():
+    # with to_prep, RT applies only the causal filter (no whole-trace detrend & taper)
+    rng = np.random.default_rng(1)
+    stream = make_stream(rng)
+    with contextlib.redirect_stdout(io.StringIO()):
+        picks = picker_pal.STA_LTA_Kurtosis().pick(stream.copy())
+        picks_rt = pick_rt(picker_pal.STA_LTA_Kurtosis_RT(), stream, rng)[0]
+    check_picks(picks, picks_rt, 0.1)
@@ -0,0 +1,54 @@
+""" Streaming association: rolling pick buffer stays bounded across add_picks calls
+"""
+import io, contextlib
+import numpy as np
+import picker_pal
+from conftest import OT_Assoc
+
+dtype = picker_pal.STA_LTA_Kurtosis.pick_dtype
+
+def make_picks(evt_ots, num_sta, rng):
+    picks = np.zeros(len(evt_ots)*num_sta, dtype=dtype)
+    picks['sta_idx'] = np.tile(np.arange(num_sta), len(evt_ots))
+    picks['sta_ot'] = np.repeat(evt_ots, num_sta) + rng.normal(0, 0.3, len(picks))
+    picks['tp'], picks['ts'] = picks['sta_ot'] + 5., picks['sta_ot'] + 10.
+    picks['s_amp'] = 1e-6
+    return picks
+
+def test_buffer_bounded_with_dense_event_before_t_safe():
+    # 200 small (4-sta) events per day + one dense (10-sta) event 35s before each day end
+    rng = np.random.default_rng(0)
+    sta_dict = {'XX.S%s'%ii: [30+0.1*ii, 100+0.1*ii, 0., 1.] for ii in range(10)}
+    associator = OT_Assoc(sta_dict, xy_grid=0.1, ot_dev=2.5, min_sta=4, max_drop=1)
+    num_days, num_evt, day_len = 5, 200, 86400.
+    num_events, buf_sizes = 0, []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for day_idx in range(num_days):
+            day_end = (day_idx+1) * day_len
+            evt_ots = day_idx*day_len + 300. + 400.*np.arange(num_evt)
+            picks = np.concatenate([make_picks(evt_ots, 4, rng), make_picks([day_end-35.], 10, rng)])
+            events_loc, _ = associator.add_picks(picks, t_safe=day_end-30.)
+            num_events += len(events_loc)
+            buf_sizes.append(len(associator.buf_picks))
+            # all small events of the day are emitted, the dense one is deferred
+            assert len(events_loc) == num_evt + (day_idx>0)
+        events_loc, _ = associator.flush()
+        num_events += len(events_loc)
+    assert max(buf_sizes) <= 20
+    assert num_events == num_days * (num_evt+1)
+
+def test_stream_same_as_batch():
+    rng = np.random.default_rng(1)
+    sta_dict = {'XX.S%s'%ii: [30+0.1*ii, 100+0.1*ii, 0., 1.] for ii in range(10)}
+    associator = OT_Assoc(sta_dict, xy_grid=0.1, ot_dev=2.5, min_sta=4, max_drop=1)
+    evt_ots = np.sort(rng.uniform(0, 3*86400., 600))
+    picks = make_picks(evt_ots, 6, rng)
+    picks = picks[rng.random(len(picks)) > 0.2]
+    with contextlib.redirect_stdout(io.StringIO()):
+        batch_loc, _ = associator.associate(picks)
+        stream_loc = []
+        picks = np.sort(picks, order='sta_ot')
+        for idx in range(0, len(picks), 500):
+            stream_loc += associator.add_picks(picks[idx:idx+500])[0]
+        stream_loc += associator.flush()[0]
+    assert sorted([evt['evt_ot'] for evt in stream_loc]) == sorted([evt['evt_ot'] for evt in batch_loc])
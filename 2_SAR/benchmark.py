@@ -0,0 +1,70 @@
+""" Benchmark SAR inference on cpu
+    float32 baseline vs. tuned cpu path (inference mode, thread count, int8 dynamic quantization)
+    usage: python benchmark.py --ckpt_dir=output/eg_ckpt --num_threads=1,4 --batch_sizes=1,8,20,64
+    *note: random weights are used if no ckpt_dir
+"""
+import os, glob
+import time
+import argparse
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from models import SAR
+import config
+
+cfg = config.Config()
+num_steps = cfg.rnn_num_steps
+input_size = int(cfg.rnn_step_len * cfg.num_chn * cfg.samp_rate)
+
+def load_model(ckpt_dir):
+    model = SAR()
+    if ckpt_dir:
+        ckpt = sorted(glob.glob(os.path.join(ckpt_dir, '*.ckpt')), key=lambda x: int(os.path.basename(x).split('_')[0]))[-1]
+        print('SAR checkpoint: %s'%ckpt)
+        model.load_state_dict(torch.load(ckpt, map_location='cpu'))
+    return model.eval()
+
+# windows per sec & softmax probs of all batches
+def run_model(model, data_seq, batch_size, use_inference_mode=True):
+    num_win = data_seq.size(0)
+    probs = []
+    with torch.inference_mode(use_inference_mode):
+        # warm-up (untimed): first calls allocate buffers & start threads
+        model(data_seq[0:batch_size])
+        t = time.time()
+        for idx in range(0, num_win, batch_size):
+            probs.append(F.softmax(model(data_seq[idx:idx+batch_size]), dim=-1).detach().numpy())
+    return num_win / (time.time() - t), np.concatenate(probs)
+
+def bench_cpu(model, num_threads, batch_sizes, num_win):
+    print('SAR cpu inference: {} wins, {} steps x {} inputs'.format(num_win, num_steps, input_size))
+    data_seq = torch.randn(num_win, num_steps, input_size)
+    model_int8 = torch.quantization.quantize_dynamic(model, {nn.GRU, nn.Linear}, dtype=torch.qint8)
+    default_threads = torch.get_num_threads()
+    for batch_size in batch_sizes:
+        # float32 baseline: default threads, autograd on
+        torch.set_num_threads(default_threads)
+        speed_base, _ = run_model(model, data_seq, batch_size, False)
+        print('  batch {:>3} | baseline ({} threads) {:.1f} win/s'.format(batch_size, default_threads, speed_base))
+        for num_thread in num_threads:
+            torch.set_num_threads(num_thread)
+            speed_fp32, prob_fp32 = run_model(model, data_seq, batch_size)
+            speed_int8, prob_int8 = run_model(model_int8, data_seq, batch_size)
+            print('  batch {:>3} | {:>4} threads | fp32 {:>7.1f} win/s x{:.1f} | int8 {:>7.1f} win/s x{:.1f} | int8 max prob dev {:.2e}'\
+                .format(batch_size, num_thread, speed_fp32, speed_fp32/speed_base,
+                speed_int8, speed_int8/speed_base, np.amax(abs(prob_int8 - prob_fp32))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ckpt_dir', type=str, default=None)
+    parser.add_argument('--num_threads', type=str, default='1,%s'%cfg.cpu_threads)
+    parser.add_argument('--batch_sizes', type=str, default='1,%s,%s,64'%(cfg.cpu_batch_size, cfg.picker_batch_size))
+    parser.add_argument('--num_win', type=int, default=640)
+    args = parser.parse_args()
+    torch.manual_seed(0)
+    model = load_model(args.ckpt_dir)
+    num_threads = [int(num) for num in args.num_threads.split(',')]
+    batch_sizes = [int(num) for num in args.batch_sizes.split(',')]
+    bench_cpu(model, num_threads, batch_sizes, args.num_win)
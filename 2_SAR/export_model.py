@@ -0,0 +1,80 @@
+""" Export SAR checkpoint to TorchScript & ONNX
+    ckpt --> {ckpt}.pt (traced TorchScript) & {ckpt}.onnx (dynamic batch axis)
+    then check the probs of exported models against the eager model
+  Usage
+    python export_model.py --ckpt_dir=output/eg_ckpt --ckpt_idx=-1
+    *note: TorchScript is traced on the export device (--gpu_idx, -1 for cpu); ONNX check needs onnxruntime
+"""
+import os
+import argparse
+import numpy as np
+import torch
+import torch.nn.functional as F
+from models import SAR
+from picker import get_ckpt_path, ONNX_Model
+import config
+import warnings
+warnings.filterwarnings("ignore")
+
+cfg = config.Config()
+num_steps = cfg.rnn_num_steps
+input_size = int(cfg.rnn_step_len * cfg.num_chn * cfg.samp_rate)
+
+# softmax probs of model in numpy
+def calc_probs(model, data_seq):
+    with torch.inference_mode():
+        return F.softmax(model(data_seq), dim=-1).cpu().numpy()
+
+# trace to {out_path}.pt & export to {out_path}.onnx, with dynamic num of wins
+def export(model, example, out_path, opset=14):
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    traced.save(out_path + '.pt')
+    torch.onnx.export(model, example, out_path + '.onnx',
+        input_names=['data_seq'], output_names=['pred_logits'],
+        dynamic_axes={'data_seq':{0:'num_win'}, 'pred_logits':{0:'num_win'}},
+        opset_version=opset)
+
+# max prob dev of exported models to eager model, on several batch sizes
+def check_export(model, exported, device, batch_sizes, tol=1e-4):
+    is_same = True
+    for batch_size in batch_sizes:
+        data_seq = torch.randn(batch_size, num_steps, input_size, device=device)
+        prob_eager = calc_probs(model, data_seq)
+        for runtime, exp_model in exported.items():
+            max_dev = np.amax(abs(calc_probs(exp_model, data_seq) - prob_eager))
+            print('  batch {:>3} | {} max prob dev {:.2e}'.format(batch_size, runtime, max_dev))
+            if not max_dev < tol: is_same = False
+    return is_same
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ckpt_dir', type=str)
+    parser.add_argument('--ckpt_idx', type=int, default=-1)
+    parser.add_argument('--gpu_idx', type=int, default=-1)
+    parser.add_argument('--opset', type=int, default=14)
+    parser.add_argument('--tol', type=float, default=1e-4)
+    args = parser.parse_args()
+    device = torch.device("cuda:%s"%args.gpu_idx) if args.gpu_idx>=0 else torch.device("cpu")
+    # load eager model
+    ckpt_path = get_ckpt_path(args.ckpt_dir, args.ckpt_idx)
+    print('SAR checkpoint: %s'%ckpt_path)
+    model = SAR()
+    model.load_state_dict(torch.load(ckpt_path, map_location=device))
+    model.to(device)
+    model.eval()
+    example = torch.randn(cfg.picker_batch_size, num_steps, input_size, device=device)
+    # TorchScript & ONNX
+    out_path = os.path.splitext(ckpt_path)[0]
+    export(model, example, out_path, args.opset)
+    print('TorchScript saved: %s.pt'%out_path)
+    print('ONNX saved: %s.onnx'%out_path)
+    # equivalence check
+    print('check exported models against eager model')
+    exported = {'torchscript': torch.jit.load(out_path + '.pt', map_location=device)}
+    try: exported['onnx'] = ONNX_Model(out_path + '.onnx', device)
+    except ImportError: print('  onnxruntime not installed, skip ONNX check')
+    batch_sizes = sorted(set([1, cfg.cpu_batch_size, cfg.picker_batch_size, 2*cfg.picker_batch_size+1]))
+    if check_export(model, exported, device, batch_sizes, args.tol): print('exported models match eager model')
+    else: print('WARNING: exported models deviate from eager model (tol {:.0e})'.format(args.tol))
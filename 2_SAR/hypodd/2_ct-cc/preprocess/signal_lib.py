@@ -1,8 +1,13 @@
 """ Signal processing library
 """
-import numpy as np
+import os, sys
 from obspy import UTCDateTime
 from scipy.signal import correlate
+try: import preprocess_lib
+except ImportError:
+    # 1_PAL not on sys.path (set in config): fall back to 1_PAL of this repo
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../..', '1_PAL')))
+    import preprocess_lib
 
 def preprocess(stream, samp_rate, freq_band):
     # time alignment
@@ -10,23 +15,11 @@ def preprocess(stream, samp_rate, freq_band):
     end_time = min([trace.stats.endtime for trace in stream])
     if start_time>end_time: print('bad data!'); return []
     st = stream.slice(start_time, end_time)
-    # resample data
-    st = st.detrend('demean').detrend('linear').taper(max_percentage=0.05, max_length=10.)
-    org_rate = st[0].stats.sampling_rate
-    if org_rate!=samp_rate: st.resample(samp_rate)
-    for ii in range(3):
-        st[ii].data[np.isnan(st[ii].data)] = 0
-        st[ii].data[np.isinf(st[ii].data)] = 0
-    # filter
-    freq_min, freq_max = freq_band
-    if freq_min and freq_max:
-        return st.filter('bandpass', freqmin=freq_min, freqmax=freq_max)
-    elif not freq_max and freq_min:
-        return st.filter('highpass', freq=freq_min)
-    elif not freq_min and freq_max:
-        return st.filter('lowpass', freq=freq_max)
-    else:
-        print('filter type not supported!'); return []
+    # remove nan & inf, detrend, taper, resample & filter
+    data = preprocess_lib.stream2data(st)
+    data = preprocess_lib.preprocess(data, st[0].stats.sampling_rate, freq_band, max_gap=None, taper_len=10., out_rate=samp_rate)
+    if data is None: print('filter type not supported!'); return []
+    return preprocess_lib.data2stream(data, st, samp_rate)
 
 def obspy_slice(stream, t0, t1):
     st = stream.slice(t0, t1)
@@ -1,11 +1,13 @@
 import os, glob
 import time
 import torch
+import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
 from obspy import UTCDateTime
 from models import SAR
 import config
+import preprocess_lib
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -24,9 +26,14 @@ step_stride_npts = int(step_stride * samp_rate)
 num_steps = cfg.rnn_num_steps
 freq_band = cfg.freq_band
 global_max_norm = cfg.global_max_norm
+prep_block = cfg.prep_block
 # picker config
 trig_thres = cfg.trig_thres
 batch_size = cfg.picker_batch_size
+cpu_batch_size = cfg.cpu_batch_size
+cpu_threads = cfg.cpu_threads
+cpu_quantize = cfg.cpu_quantize
+sar_runtime = cfg.sar_runtime
 tp_dev = cfg.tp_dev
 ts_dev = cfg.ts_dev
 amp_win = cfg.amp_win
@@ -36,22 +43,86 @@ amp_ratio_thres = cfg.amp_ratio_thres
 win_peak = cfg.win_peak
 win_peak_npts = int(win_peak * samp_rate)
 
+# ckpt path of ckpt_idx (-1 for the latest)
+def get_ckpt_path(ckpt_dir, ckpt_idx=-1):
+    if int(ckpt_idx)==-1:
+        ckpt_idx = max([int(os.path.basename(ckpt).split('_')[0]) for ckpt in glob.glob(os.path.join(ckpt_dir, '*.ckpt'))])
+    return sorted(glob.glob(os.path.join(ckpt_dir, '%s_*.ckpt'%ckpt_idx)))[0]
+
+class ONNX_Model(object):
+  """ SAR model exported to ONNX, run with onnxruntime (torch tensor in & out)
+    on cuda, in & out tensors are bound on device (IO binding), so no host copy per batch
+  """
+  def __init__(self, onnx_path, device):
+    import onnxruntime as ort
+    sess_options = ort.SessionOptions()
+    if device.type=='cpu': sess_options.intra_op_num_threads = cpu_threads
+    providers = [('CUDAExecutionProvider', {'device_id': device.index or 0}),'CPUExecutionProvider'] \
+        if device.type=='cuda' else ['CPUExecutionProvider']
+    self.session = ort.InferenceSession(onnx_path, sess_options, providers=providers)
+    self.out_dim = self.session.get_outputs()[0].shape[-1]
+    self.device = device
+
+  def __call__(self, data_seq):
+    if self.device.type=='cpu':
+        pred_logits = self.session.run(None, {'data_seq': data_seq.numpy()})[0]
+        return torch.from_numpy(pred_logits)
+    data_seq = data_seq.contiguous()
+    pred_logits = torch.empty(data_seq.size(0), data_seq.size(1), self.out_dim, dtype=torch.float32, device=self.device)
+    binding = self.session.io_binding()
+    binding.bind_input('data_seq', 'cuda', self.device.index or 0, np.float32, tuple(data_seq.shape), data_seq.data_ptr())
+    binding.bind_output('pred_logits', 'cuda', self.device.index or 0, np.float32, tuple(pred_logits.shape), pred_logits.data_ptr())
+    self.session.run_with_iobinding(binding)
+    return pred_logits
+
 class SAR_Picker(object):
   """ SAR picker for raw stream data
+    gpu_idx=-1 (or no cuda) to run on cpu
+    runtime: eager (ckpt), torchscript (.pt) or onnx (.onnx), see export_model.py
+    *note: the model is loaded at the first pick (& dropped on pickling),
+      so that the picker can be sent to spawned DataLoader workers
   """
-  def __init__(self, ckpt_dir, ckpt_idx=-1, gpu_idx=0):
-    if int(ckpt_idx)==-1:
-        ckpt_idx = max([int(os.path.basename(ckpt).split('_')[0]) for ckpt in glob.glob(os.path.join(ckpt_dir, '*.ckpt'))])
-    ckpt_idx = sorted(glob.glob(os.path.join(ckpt_dir, '%s_*.ckpt'%ckpt_idx)))[0] 
-    print('SAR checkpoint: %s'%ckpt_idx)
-    # load model
-    self.device = torch.device("cuda:%s"%gpu_idx)
-    self.model = SAR()
-    self.model.load_state_dict(torch.load(ckpt_idx, map_location=self.device))
-    self.model.to(self.device)
-    self.model.eval()
+  def __init__(self, ckpt_dir, ckpt_idx=-1, gpu_idx=0, runtime=sar_runtime):
+    ckpt_path = get_ckpt_path(ckpt_dir, ckpt_idx)
+    # set device
+    if gpu_idx>=0 and torch.cuda.is_available():
+        self.device = torch.device("cuda:%s"%gpu_idx)
+        self.batch_size = batch_size
+    else:
+        self.device = torch.device("cpu")
+        self.batch_size = cpu_batch_size
+    # model path of runtime
+    if runtime not in ['eager','torchscript','onnx']:
+        raise ValueError("runtime should be 'eager', 'torchscript' or 'onnx', got %r"%runtime)
+    self.model_path = ckpt_path if runtime=='eager' else os.path.splitext(ckpt_path)[0] \
+        + {'torchscript':'.pt', 'onnx':'.onnx'}[runtime]
+    self.runtime = runtime
+    self.model = None
+    print('SAR model ({}): {}'.format(runtime, self.model_path))
+
+  # InferenceSession & ScriptModule can not be pickled: drop model, reload in worker
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state['model'] = None
+    return state
+
+  def load_model(self):
+    if self.runtime=='torchscript':
+        self.model = torch.jit.load(self.model_path, map_location=self.device)
+        self.model.eval()
+    elif self.runtime=='onnx': self.model = ONNX_Model(self.model_path, self.device)
+    else:
+        self.model = SAR()
+        self.model.load_state_dict(torch.load(self.model_path, map_location=self.device))
+        self.model.to(self.device)
+        self.model.eval()
+        if self.device.type=='cpu' and cpu_quantize:
+            self.model = torch.quantization.quantize_dynamic(self.model, {nn.GRU, nn.Linear}, dtype=torch.qint8)
 
   def pick(self, stream, fout=None):
+    # intra-op threads are per process: set in the (DataLoader worker) process that picks
+    if self.device.type=='cpu': torch.set_num_threads(cpu_threads)
+    if self.model is None: self.load_model()
     # 1. preprocess stream data 
     print('1. preprocess stream data')
     t = time.time()
@@ -64,13 +135,13 @@ class SAR_Picker(object):
     num_win = int((end_time - start_time - win_len) / win_stride) + 1
     st_len_npts = min([len(trace) for trace in stream])
     st_data = np.array([trace.data[0:st_len_npts] for trace in stream], dtype=np.float32)
-    st_data_cuda = torch.from_numpy(st_data).cuda(device=self.device)
+    st_data_cuda = torch.from_numpy(st_data).to(self.device)
     # find miss chn
     st_raw_npts = min([len(tr) for tr in st_raw])
     st_raw_data = np.array([tr.data[0:st_raw_npts] for tr in st_raw])
     raw_stride = int(st_raw[0].stats.sampling_rate * win_stride)
     raw_win_npts = int(st_raw[0].stats.sampling_rate * win_len)
-    miss_chn = np.array([np.sum(st_raw_data[:, i*raw_stride : i*raw_stride+raw_win_npts]==0, axis=1)>win_len_npts/4 for i in range(num_win)])
+    miss_chn = self.calc_miss_chn(st_raw_data, num_win, raw_stride, raw_win_npts)
     # 2. run SAR picker
     picks_raw = self.run_sar(st_data_cuda, start_time, num_win, miss_chn)
     num_picks = len(picks_raw)
@@ -87,11 +158,14 @@ class SAR_Picker(object):
     print('  %s picks dropped'%len(to_drop))
     # 3.2 get s_amp & glitch removal
     print('  get s_amp & glitch removal')
+    # cumsum of velocity, shared by all picks
+    cum_velo = self.calc_cum_velo(np.array([trace.data[0:st_len_npts] for trace in stream], dtype=np.float64))
+    st_start = stream[0].stats.starttime
     picks = []
     for [tp, ts, p_prob, s_prob] in picks_raw:
-        st = stream.slice(tp-amp_win[0], ts+amp_win[1]).copy()
-        amp_data = np.array([tr.data[0:amp_win_npts] for tr in st])
-        s_amp = self.get_s_amp(amp_data)
+        amp_idx0 = max(0, int(round((tp - amp_win[0] - st_start) * samp_rate)))
+        amp_idx1 = min(st_len_npts, amp_idx0 + amp_win_npts)
+        s_amp = self.get_s_amp(cum_velo, amp_idx0, amp_idx1)
         if rm_glitch and self.remove_glitch(stream, tp, ts): continue
         picks.append([net_sta, tp, ts, s_amp, p_prob, s_prob])
         if fout:
@@ -99,9 +173,11 @@ class SAR_Picker(object):
     print('total run time {:.2f}s'.format(time.time()-t))
     if not fout: return picks
 
+  @torch.inference_mode()
   def run_sar(self, st_data_cuda, start_time, num_win, miss_chn):
     print('2. run SAR for phase picking')
     t = time.time()
+    batch_size = self.batch_size
     num_batch = int(np.ceil(num_win / batch_size))
     picks_raw = []
     dtype = [('tp','O'),('ts','O'),('p_prob','O'),('s_prob','O')]
@@ -111,45 +187,63 @@ class SAR_Picker(object):
         if n_win==0: n_win = batch_size
         win_idx_list = [nn + batch_idx*batch_size for nn in range(n_win)]
         data_seq = self.st2seq(st_data_cuda, win_idx_list, miss_chn)
-        pred_logits = self.model(data_seq)
-        pred_probs = F.softmax(pred_logits, dim=-1).detach().cpu().numpy()
-        # decode to sec
-        for nn, pred_prob in enumerate(pred_probs):
-            win_idx = nn + batch_idx*batch_size
-            t0 = start_time + win_idx * win_stride
-            if sum(miss_chn[win_idx])==3: continue
-            pred_prob_p, pred_prob_s = pred_prob[:,1], pred_prob[:,2]
-            pred_prob_p[np.isnan(pred_prob_p)] = 0
-            pred_prob_s[np.isnan(pred_prob_s)] = 0
-            if min(np.amax(pred_prob_p), np.amax(pred_prob_s)) < trig_thres: continue
-            p_idxs = np.where(pred_prob_p>=trig_thres)[0]
-            s_idxs = np.where(pred_prob_s>=trig_thres)[0]
-            p_dets = np.split(p_idxs, np.where(np.diff(p_idxs)!=1)[0] + 1)
-            s_dets = np.split(s_idxs, np.where(np.diff(s_idxs)!=1)[0] + 1)
-            p_probs = [np.amax(pred_prob_p[p_det]) for p_det in p_dets]
-            s_probs = [np.amax(pred_prob_s[s_det]) for s_det in s_dets]
-            p_idxs = [np.median(x) for x in p_dets]
-            s_idxs = [np.median(x) for x in s_dets]
-            for ii, p_idx in enumerate(p_idxs):
-                tp = t0 + step_len/2 + step_stride*p_idx
-                p_prob = p_probs[ii]
-                for jj, s_idx in enumerate(s_idxs):
-                    if s_idx<=p_idx: continue
-                    ts = t0 + step_len/2 + step_stride*s_idx
-                    s_prob = s_probs[jj]
-                    picks_raw.append((tp, ts, p_prob, s_prob))
+        pred_probs = F.softmax(self.model(data_seq), dim=-1)
+        # decode on device, then pair P&S on cpu
+        is_valid = torch.from_numpy(np.sum(miss_chn[win_idx_list], axis=1)<num_chn).to(self.device)
+        det_win, det_phase, det_idx2, det_prob = self.decode_probs(pred_probs, is_valid)
+        picks_raw += self.pair_dets(start_time, det_win + batch_idx*batch_size, det_phase, det_idx2, det_prob)
     print('  {} raw P&S picks | SAR run time {:.2f}s'.format(len(picks_raw), time.time()-t))
     return np.array(picks_raw, dtype=dtype)
 
+  # batch probs (num_win, num_steps, 3) --> runs of P&S prob over trig_thres: win, phase (0 for P), 2*median idx, peak prob
+  def decode_probs(self, pred_probs, is_valid):
+    pred_probs = torch.nan_to_num(pred_probs[:,:,1:3].transpose(1,2), nan=0.)  # num_win * 2 * num_steps
+    is_trig = pred_probs >= trig_thres
+    # wins with both P&S triggered
+    is_valid = is_valid & is_trig.any(dim=2).all(dim=1)
+    is_trig &= is_valid.view(-1,1,1)
+    # runs of trig
+    pad = torch.zeros_like(is_trig[:,:,0:1])
+    run_start = is_trig & ~torch.cat([pad, is_trig[:,:,:-1]], dim=2)
+    run_end = is_trig & ~torch.cat([is_trig[:,:,1:], pad], dim=2)
+    start_idx = torch.nonzero(run_start)
+    end_idx = torch.nonzero(run_end)[:,2]
+    # peak prob of each run
+    run_id = torch.cumsum(run_start.flatten(), 0) - 1
+    is_trig = is_trig.flatten()
+    run_prob = torch.zeros(start_idx.size(0), dtype=pred_probs.dtype, device=pred_probs.device)
+    run_prob.scatter_reduce_(0, run_id[is_trig], pred_probs.flatten()[is_trig], 'amax')
+    dets = torch.cat([start_idx[:,0:2], (start_idx[:,2] + end_idx).view(-1,1)], dim=1).cpu().numpy()
+    return dets[:,0], dets[:,1], dets[:,2], run_prob.cpu().numpy()
+
+  # pair each P det with the S dets after it in the same win --> raw picks [tp, ts, p_prob, s_prob]
+  def pair_dets(self, start_time, det_win, det_phase, det_idx2, det_prob):
+    is_p = det_phase==0
+    p_win, p_idx2, p_prob = det_win[is_p], det_idx2[is_p], det_prob[is_p]
+    s_win, s_idx2, s_prob = det_win[~is_p], det_idx2[~is_p], det_prob[~is_p]
+    # S dets are sorted by (win, idx)
+    key_len = 2*num_steps
+    s_key = s_win*key_len + s_idx2
+    s_idx0 = np.searchsorted(s_key, p_win*key_len + p_idx2, side='right')
+    s_idx1 = np.searchsorted(s_key, (p_win+1)*key_len, side='left')
+    num_pair = s_idx1 - s_idx0
+    p_pair = np.repeat(np.arange(len(p_win)), num_pair)
+    s_pair = np.arange(np.sum(num_pair)) + np.repeat(s_idx0 - np.cumsum(num_pair) + num_pair, num_pair)
+    picks_raw = []
+    for win_idx, p_idx, s_idx, p_prob_i, s_prob_i in zip(p_win[p_pair], p_idx2[p_pair]/2, s_idx2[s_pair]/2, p_prob[p_pair], s_prob[s_pair]):
+        t0 = start_time + win_idx * win_stride
+        picks_raw.append((t0 + step_len/2 + step_stride*p_idx, t0 + step_len/2 + step_stride*s_idx, p_prob_i, s_prob_i))
+    return picks_raw
+
+  # sliding wins --> batch of rnn steps (num_win, num_steps, num_chn*step_len_npts)
   def st2seq(self, st_data_cuda, win_idx_list, miss_chn):
     num_win = len(win_idx_list)
-    data_seq = torch.zeros((num_win, num_steps, num_chn*step_len_npts), dtype=torch.float32, device=self.device)
-    for i,win_idx in enumerate(win_idx_list):
-        win_data = st_data_cuda[:,win_idx*win_stride_npts : win_idx*win_stride_npts+win_len_npts].clone()
-        win_data = self.preprocess_cuda(win_data, miss_chn[win_idx])
-        win_data = win_data.unfold(1, step_len_npts, step_stride_npts).permute(1,0,2)
-        data_seq[i] = win_data.reshape(win_data.size(0), -1)
-    return data_seq
+    # strided view of all wins (num_all_win, num_chn, win_len_npts), then copy selected wins
+    win_data = st_data_cuda.unfold(1, win_len_npts, win_stride_npts).permute(1,0,2)[win_idx_list]
+    is_miss = torch.from_numpy(miss_chn[win_idx_list]).to(self.device)
+    win_data = self.preprocess_cuda(win_data, is_miss)
+    win_data = win_data.unfold(2, step_len_npts, step_stride_npts).permute(0,2,1,3)
+    return win_data.reshape(num_win, win_data.size(1), -1)
 
   def preprocess(self, st, max_gap=5.):
     # align time
@@ -160,58 +254,47 @@ class SAR_Picker(object):
     st = st.slice(start_time, end_time, nearest_sample=True)
     if len(st)!=num_chn: return [], []
     # remove nan & inf
-    for ii in range(3):
-        st[ii].data[np.isnan(st[ii].data)] = 0
-        st[ii].data[np.isinf(st[ii].data)] = 0
-    if max(st.max())==0: return [], []
-    st_raw = st.copy()
-    # fill data gap
-    max_gap_npts = int(max_gap*samp_rate)
-    for tr in st:
-        npts = len(tr.data)
-        data_diff = np.diff(tr.data)
-        gap_idx = np.where(data_diff==0)[0]
-        gap_list = np.split(gap_idx, np.where(np.diff(gap_idx)!=1)[0] + 1)
-        gap_list = [gap for gap in gap_list if len(gap)>=10]
-        num_gap = len(gap_list)
-        for ii,gap in enumerate(gap_list):
-            idx0, idx1 = max(0, gap[0]-1), min(npts-1, gap[-1]+1)
-            if ii<num_gap-1: idx2 = min(idx1+(idx1-idx0), idx1+max_gap_npts, gap_list[ii+1][0])
-            else: idx2 = min(idx1+(idx1-idx0), idx1+max_gap_npts, npts-1)
-            if idx1==idx2: continue
-            if idx2==idx1+(idx1-idx0): tr.data[idx0:idx1] = tr.data[idx1:idx2]
-            else:
-                num_tile = int(np.ceil((idx1-idx0)/(idx2-idx1)))
-                tr.data[idx0:idx1] = np.tile(tr.data[idx1:idx2], num_tile)[0:idx1-idx0]
-    # resample 
-    st = st.detrend('demean').detrend('linear').taper(max_percentage=0.05, max_length=5.)
+    data = preprocess_lib.stream2data(st)
+    if np.amax(abs(data))==0: return [], []
+    st_raw = preprocess_lib.data2stream(data.copy(), st)
+    # fill gap, detrend, taper, resample & filter
     org_rate = st[0].stats.sampling_rate
-    if org_rate!=samp_rate: st.resample(samp_rate)
-    # filter
-    freq_min, freq_max = freq_band
-    if freq_min and freq_max:
-        return st.filter('bandpass', freqmin=freq_min, freqmax=freq_max), st_raw
-    elif not freq_max and freq_min: 
-        return st.filter('highpass', freq=freq_min), st_raw
-    elif not freq_min and freq_max: 
-        return st.filter('lowpass', freq=freq_max), st_raw
-    else:
-        print('filter type not supported!'); return [], []
+    data = preprocess_lib.preprocess(data, org_rate, freq_band, max_gap, min_gap_npts=10, out_rate=samp_rate, block_len=prep_block)
+    if data is None: print('filter type not supported!'); return [], []
+    return preprocess_lib.data2stream(data, st, samp_rate), st_raw
 
-  # preprocess cuda data (in-place)
+  # preprocess batch of cuda win data (num_win, num_chn, npts)
   def preprocess_cuda(self, data, is_miss):
-    # fix missed channel
-    if 0<sum(is_miss)<3: data[is_miss] = data[~is_miss][-1]
+    # fix missed channel with the last good one
+    last_good = num_chn - 1 - torch.argmax(torch.flip(~is_miss, [1]).int(), dim=1)
+    to_fix = is_miss & (~is_miss).any(dim=1, keepdim=True)
+    fix_data = data[torch.arange(data.size(0), device=data.device), last_good]
+    data = torch.where(to_fix.unsqueeze(-1), fix_data.unsqueeze(1), data)
     # rmean & norm
-    data -= torch.mean(data, axis=1).view(num_chn,1)
-    if global_max_norm: data /= torch.max(abs(data))
-    else: data /= torch.max(abs(data), axis=1).values.view(num_chn,1)
+    data -= torch.mean(data, dim=2, keepdim=True)
+    if global_max_norm: data /= torch.amax(abs(data), dim=(1,2), keepdim=True)
+    else: data /= torch.amax(abs(data), dim=2, keepdim=True)
     return data
 
-  # get S amplitide
-  def get_s_amp(self, velo):
-    velo -= np.reshape(np.mean(velo, axis=1), [velo.shape[0],1])
-    disp = np.cumsum(velo, axis=1)
+  # miss chn of each sliding win: > 1/4 win of zeros in raw data
+  def calc_miss_chn(self, raw_data, num_win, raw_stride, raw_win_npts):
+    cum_zero = np.zeros([raw_data.shape[0], raw_data.shape[1]+1], dtype=np.int64)
+    np.cumsum(raw_data==0, axis=1, out=cum_zero[:,1:])
+    idx0 = np.minimum(np.arange(num_win) * raw_stride, raw_data.shape[1])
+    idx1 = np.minimum(idx0 + raw_win_npts, raw_data.shape[1])
+    return (cum_zero[:, idx1] - cum_zero[:, idx0]).T > win_len_npts/4
+
+  # cumsum of velocity (with leading 0)
+  def calc_cum_velo(self, velo):
+    cum_velo = np.zeros([velo.shape[0], velo.shape[1]+1])
+    np.cumsum(velo, axis=1, out=cum_velo[:,1:])
+    return cum_velo
+
+  # get S amplitide of win [idx0, idx1): cumsum of demeaned win = cumsum of win - win mean * (1,...,npts)
+  def get_s_amp(self, cum_velo, idx0, idx1):
+    npts = idx1 - idx0
+    velo_mean = (cum_velo[:, idx1] - cum_velo[:, idx0]) / npts
+    disp = cum_velo[:, idx0+1:idx1+1] - cum_velo[:, idx0:idx0+1] - velo_mean.reshape(-1,1) * np.arange(1, npts+1)
     disp /= samp_rate
     return np.amax(np.sum(disp**2, axis=0))**0.5
 
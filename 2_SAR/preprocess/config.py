@@ -2,6 +2,7 @@
 """
 import sys
 sys.path.append('/home/zhouyj/software/2_SAR/preprocess')
+sys.path.append('/home/zhouyj/software/1_PAL')
 import reader
 
 class Config(object):
@@ -14,6 +15,7 @@ class Config(object):
     self.freq_band = [1,20]
     self.global_max_norm = False
     self.to_prep = True
+    self.prep_block = None  # block len (sec) for polyphase resample (fewer temporaries, not bounded memory), None for whole-trace FFT resample
     self.train_ratio = 0.9
     self.valid_ratio = 0.1  # ratio of samples to cut for training
     self.max_assoc_ratio = 0.5  # neg_cut_ratio = (max_ratio-assoc_ratio)/max_ratio
@@ -17,6 +17,7 @@ warnings.filterwarnings("ignore")
 # cut params
 cfg = config.Config()
 to_prep = cfg.to_prep
+prep_block = cfg.prep_block
 samp_rate = cfg.samp_rate
 freq_band = cfg.freq_band
 global_max_norm = cfg.global_max_norm
@@ -43,7 +44,7 @@ def cut_event_window(stream_paths, t0, t1, out_paths):
     st += read(stream_paths[1], starttime=t0-win_len/2, endtime=t1+win_len/2)
     st += read(stream_paths[2], starttime=t0-win_len/2, endtime=t1+win_len/2)
     if 0 in st.max() or len(st)!=3: return False
-    if to_prep: st = preprocess(st, samp_rate, freq_band)
+    if to_prep: st = preprocess(st, samp_rate, freq_band, block_len=prep_block)
     st = st.slice(t0, t1)
     if 0 in st.max() or len(st)!=3: return False
     # check FN
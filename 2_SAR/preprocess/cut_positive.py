@@ -26,6 +26,7 @@ train_ratio = cfg.train_ratio
 valid_ratio = cfg.valid_ratio
 freq_band = cfg.freq_band
 to_prep = cfg.to_prep
+prep_block = cfg.prep_block
 global_max_norm = cfg.global_max_norm
 num_aug = cfg.num_aug
 max_noise = cfg.max_noise
@@ -66,7 +67,7 @@ def add_noise(st, stream_paths, tp, ts, picks):
     st_noise += read(stream_paths[1], starttime=t0-win_len/2, endtime=t1+win_len/2)
     st_noise += read(stream_paths[2], starttime=t0-win_len/2, endtime=t1+win_len/2)
     if len(st_noise)!=3: return st
-    if to_prep: st_noise = preprocess(st_noise, samp_rate, freq_band)
+    if to_prep: st_noise = preprocess(st_noise, samp_rate, freq_band, block_len=prep_block)
     st_noise = st_noise.slice(t0, t1).normalize(global_max=global_max_norm)
     if len(st_noise)!=3: return st
     npts = min([len(tr) for tr in st+st_noise])
@@ -81,7 +82,7 @@ def cut_event_window(stream_paths, t0, t1):
     st += read(stream_paths[1], starttime=t0-win_len/2, endtime=t1+win_len/2)
     st += read(stream_paths[2], starttime=t0-win_len/2, endtime=t1+win_len/2)
     if 0 in st.max() or len(st)!=3: return None
-    if to_prep: st = preprocess(st, samp_rate, freq_band)
+    if to_prep: st = preprocess(st, samp_rate, freq_band, block_len=prep_block)
     st = st.slice(t0, t1)
     if 0 in st.max() or len(st)!=3: return None
     st = st.detrend('demean').normalize(global_max=global_max_norm)
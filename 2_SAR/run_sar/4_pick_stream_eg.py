@@ -10,8 +10,8 @@ data_dir = '/data/Example_data'
 time_range = '20190704-20190707'
 out_root = 'output/eg'
 # picking params
-gpu_idx = 0
-num_workers = 10
+gpu_idx = 0  # -1 for cpu
+num_workers = 10  # on cpu, each worker runs cpu_threads (config): keep num_workers x cpu_threads <= cpu cores
 ckpt_dir = 'output/eg_ckpt'
 ckpt_idx = -1  # -1 for the latest check point
 
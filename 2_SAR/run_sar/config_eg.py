@@ -2,6 +2,7 @@
 """
 import sys
 sys.path.append('/home/zhouyj/software/2_SAR/preprocess')
+sys.path.append('/home/zhouyj/software/1_PAL')
 import reader
 
 class Config(object):
@@ -14,6 +15,7 @@ class Config(object):
     self.freq_band = [1,20]
     self.global_max_norm = False
     self.to_prep = True
+    self.prep_block = None  # block len (sec) for polyphase resample (fewer temporaries, not bounded memory), None for whole-trace FFT resample
     self.train_ratio = 0.9
     self.valid_ratio = 0.1  # ratio of samples to cut for training
     self.max_assoc_ratio = 0.5  # neg_cut_ratio = (max_ratio-assoc_ratio)/max_ratio
@@ -40,6 +42,10 @@ class Config(object):
     # picking config
     self.trig_thres = 0.3
     self.picker_batch_size = 20
+    self.cpu_batch_size = 8  # picker batch size on cpu (gpu_idx=-1)
+    self.cpu_threads = 4  # intra-op threads per picker on cpu, in each worker: keep num_workers x cpu_threads <= cpu cores
+    self.cpu_quantize = False  # dynamic int8 quantization of GRU & FC on cpu
+    self.sar_runtime = 'eager'  # eager, torchscript or onnx (export with export_model.py)
     self.tp_dev = 1.5  # merge picks in different sliding win
     self.ts_dev = 1.5
     self.amp_win = [1,6]  # sec pre-P & post-S for amp calc
@@ -28,9 +28,19 @@ class Config(object):
     self.max_drop   = 1                  # max num of drop of each pick
     self.xy_margin  = 0.1                # ratio of lateral margin, relative to sta range
     self.xy_grid    = 0.02               # lateral grid width, in degree
+    self.xy_coarse  = 1                  # coarse grid factor for loc search (1 for full grid)
     self.z_grids    = np.arange(2,20,3)  # z (dep) grids
     self.vp         = 5.9                # averaged P velocity
     self.vs         = 3.5               # averaged S velocity
+    self.tt_mode    = 'grid'             # 'grid': time table per sta; 'dist': shared distance-depth table
+    self.tt_dd_grid = 0.5                # grid width of distance-depth table, in km
+    self.tt_dir     = None               # dir to cache time tables on disk (memory-mapped), e.g. 'output/tt_table'; None to keep in RAM (run_assoc_parallel then uses tt_table in the output dir)
+    self.stream_assoc = False          # assoc across days with a rolling pick buffer
+    self.max_ttp    = 30.                # max tp - sta_ot of picks (sec), for stream assoc
+    self.assoc_overlap = 60.             # overlap of time partitions in parallel assoc (sec)
+    self.tile_size  = None               # lateral size of assoc tiles, in degree (None for one grid)
+    self.tile_margin = 0.5               # sta margin around each tile, in degree
+    self.tile_workers = 1                # num of processes to assoc tiles
     # 3. data pipeline
     self.get_data_dict = dp.get_data_dict
     self.get_sta_dict = dp.get_sta_dict
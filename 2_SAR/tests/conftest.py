@@ -0,0 +1,4 @@
+import os, sys
+sar_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in [os.path.join(sar_dir, '..', '1_PAL'), os.path.join(sar_dir, 'preprocess'), sar_dir]:
+    sys.path.insert(0, os.path.abspath(path))
@@ -0,0 +1,41 @@
+""" Exported SAR models (TorchScript & ONNX) give the same probs as the eager model,
+    & the picker loads its model lazily so that it can be pickled to DataLoader workers
+"""
+import os, pickle
+import pytest
+torch = pytest.importorskip('torch')
+from models import SAR
+import picker
+from export_model import export, check_export, num_steps, input_size
+
+@pytest.fixture
+def ckpt_dir(tmp_path):
+    torch.manual_seed(0)
+    model = SAR().eval()
+    torch.save(model.state_dict(), str(tmp_path / '0_eg.ckpt'))
+    export(model, torch.randn(4, num_steps, input_size), str(tmp_path / '0_eg'))
+    return str(tmp_path)
+
+def load_eager(ckpt_dir):
+    model = SAR()
+    model.load_state_dict(torch.load(os.path.join(ckpt_dir, '0_eg.ckpt'), map_location='cpu'))
+    return model.eval()
+
+def test_exported_same_as_eager(ckpt_dir):
+    device = torch.device('cpu')
+    exported = {'torchscript': torch.jit.load(os.path.join(ckpt_dir, '0_eg.pt'), map_location=device)}
+    try: exported['onnx'] = picker.ONNX_Model(os.path.join(ckpt_dir, '0_eg.onnx'), device)
+    except ImportError: pass  # onnxruntime not installed
+    assert check_export(load_eager(ckpt_dir), exported, device, [1, 8, 21])
+
+@pytest.mark.parametrize('runtime', ['eager', 'torchscript'])
+def test_picker_pickled_without_model(ckpt_dir, runtime):
+    sar_picker = picker.SAR_Picker(ckpt_dir, gpu_idx=-1, runtime=runtime)
+    assert sar_picker.model is None
+    sar_picker.load_model()
+    sar_picker_copy = pickle.loads(pickle.dumps(sar_picker))
+    assert sar_picker_copy.model is None
+    sar_picker_copy.load_model()
+    data_seq = torch.randn(3, num_steps, input_size)
+    with torch.inference_mode():
+        assert torch.allclose(sar_picker_copy.model(data_seq), sar_picker.model(data_seq))